@@ -12,57 +12,45 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import os
-import jinja2
 import webapp2
-import hashlib
-import hmac
-import random
-import string
-import re
+from google.appengine.ext import ndb
 
-from google.appengine.ext import db
+import config
+from helpers import CompressionHelper
+from helpers import TraceHelper
 
-from handlers import BlogHandler,\
-    BlogFrontHandler,\
-    SignupHandler,\
-    LoginHandler,\
-    LogoutHandler,\
-    NewPostHandler,\
-    ViewPostHandler,\
-    EditPostHandler,\
-    DeletePostHandler,\
-    PostDeletedHandler,\
-    LikeHandler,\
-    UnlikeHandler,\
-    NewCommentHandler,\
-    EditCommentHandler,\
-    DeleteCommentHandler
-from helpers import BlogHelper,\
-    LikeHelper,\
-    PostHelper,\
-    CommentHelper
-from models import Post,\
-    Like,\
-    Comment
-
-
-# define handlers
-app = webapp2.WSGIApplication([('/', BlogFrontHandler),
-                               ('/signup', SignupHandler),
-                               ('/login', LoginHandler),
-                               ('/logout', LogoutHandler),
-                               ('/newpost', NewPostHandler),
-                               ('/post/([0-9]+)', ViewPostHandler),
-                               ('/editpost/([0-9]+)', EditPostHandler),
-                               ('/deletepost/([0-9]+)', DeletePostHandler),
-                               ('/postdeleted', PostDeletedHandler),
-                               ('/likepost/([0-9]+)', LikeHandler),
-                               ('/unlikepost/([0-9]+)', UnlikeHandler),
-                               ('/newcomment/([0-9]+)', NewCommentHandler),
-                               ('/editcomment/([0-9]+)/([0-9]+)',
-                                EditCommentHandler),
-                               ('/deletecomment/([0-9]+)/([0-9]+)',
-                                DeleteCommentHandler)
-                               ],
-                              debug=True)
+# handlers are given by import path, webapp2 imports a handler module
+# the first time its route matches, so cold starts only pay for the
+# handlers they serve (see tools/bench_coldstart.py).
+# ndb.toplevel waits for pending async datastore work (puts, tasklets)
+# before the response is returned, GzipMiddleware compresses responses,
+# TraceMiddleware traces the rpcs, templates and compression of every
+# request
+app = TraceHelper.TraceMiddleware(CompressionHelper.GzipMiddleware(
+    ndb.toplevel(webapp2.WSGIApplication([
+    ('/', 'handlers.BlogFrontHandler.BlogFrontHandler'),
+    ('/archive', 'handlers.ArchiveHandler.ArchiveHandler'),
+    ('/archive/([0-9]{4})/([0-9]{2})',
+     'handlers.ArchiveHandler.ArchiveHandler'),
+    ('/search', 'handlers.SearchHandler.SearchHandler'),
+    ('/signup', 'handlers.SignupHandler.SignupHandler'),
+    ('/login', 'handlers.LoginHandler.LoginHandler'),
+    ('/logout', 'handlers.LogoutHandler.LogoutHandler'),
+    ('/newpost', 'handlers.NewPostHandler.NewPostHandler'),
+    ('/post/([0-9]+)', 'handlers.ViewPostHandler.ViewPostHandler'),
+    ('/editpost/([0-9]+)', 'handlers.EditPostHandler.EditPostHandler'),
+    ('/deletepost/([0-9]+)', 'handlers.DeletePostHandler.DeletePostHandler'),
+    ('/postdeleted', 'handlers.PostDeletedHandler.PostDeletedHandler'),
+    ('/likepost/([0-9]+)', 'handlers.LikeHandler.LikeHandler'),
+    ('/unlikepost/([0-9]+)', 'handlers.UnlikeHandler.UnlikeHandler'),
+    ('/comments/([0-9]+)', 'handlers.CommentsHandler.CommentsHandler'),
+    ('/newcomment/([0-9]+)', 'handlers.NewCommentHandler.NewCommentHandler'),
+    ('/editcomment/([0-9]+)/([0-9]+)',
+     'handlers.EditCommentHandler.EditCommentHandler'),
+    ('/deletecomment/([0-9]+)/([0-9]+)',
+     'handlers.DeleteCommentHandler.DeleteCommentHandler'),
+    ('/admin/jobs', 'handlers.AdminJobHandler.AdminJobHandler'),
+    ('/admin/jobs/([a-z_]+)', 'handlers.AdminJobHandler.AdminJobHandler'),
+    ('/admin/cachestats',
+     'handlers.AdminCacheStatsHandler.AdminCacheStatsHandler'),
+], debug=config.DEBUG))))
@@ -0,0 +1,37 @@
+import os
+
+# blog mode, 'production' or 'development'
+# set BLOG_MODE in app.yaml (env_variables) to override,
+# by default the dev server (dev_appserver.py) runs in development mode
+MODE = os.environ.get('BLOG_MODE') or (
+    'development'
+    if os.environ.get('SERVER_SOFTWARE', 'Development').startswith(
+        'Development')
+    else 'production')
+
+PRODUCTION = MODE == 'production'
+
+# webapp2 debug mode (tracebacks in error pages)
+DEBUG = not PRODUCTION
+
+# reload templates when their files change
+TEMPLATE_AUTO_RELOAD = not PRODUCTION
+
+# stream rendered pages chunk by chunk instead of buffering them
+# (BaseHandler.render), set BLOG_STREAM_TEMPLATES=1 to turn it on.
+# the python27 runtime buffers whole responses, streaming only lowers the
+# time to first byte behind servers that pass the response through
+STREAM_TEMPLATES = os.environ.get('BLOG_STREAM_TEMPLATES') == '1'
+
+# responses of at least this many bytes are gzipped for clients which
+# accept it (helpers/CompressionHelper.py), with this zlib level
+COMPRESS_MIN_BYTES = int(os.environ.get('BLOG_COMPRESS_MIN_BYTES') or 1024)
+COMPRESS_LEVEL = 6
+
+# add the X-Trace header (datastore, memcache and template calls of the
+# request, see helpers/TraceHelper.py) to every response
+TRACE_HEADER = not PRODUCTION
+
+# requests slower than this (milliseconds) are logged with their trace,
+# set BLOG_SLOW_REQUEST_MS to override
+SLOW_REQUEST_MS = int(os.environ.get('BLOG_SLOW_REQUEST_MS') or 500)
@@ -0,0 +1,16 @@
+import json
+
+from BaseHandler import BaseHandler
+from helpers import CacheHelper
+
+
+class AdminCacheStatsHandler(BaseHandler):
+
+    '''
+    entity cache statistics of the instance serving the request
+    (admin only, see app.yaml)
+    '''
+
+    def get(self):
+        self.response.headers['Content-Type'] = 'application/json'
+        self.write(json.dumps(CacheHelper.get_stats(), sort_keys=True))
@@ -0,0 +1,102 @@
+from google.appengine.ext import deferred
+from BaseHandler import BaseHandler
+from helpers import CounterHelper
+from helpers import CommentHelper
+from helpers import LikeHelper
+from helpers import PostHelper
+from helpers import SearchHelper
+from helpers import UserHelper
+
+
+def parse_bool(value):
+    '''
+    '1', 'true', 'yes', 'on' => True, '0', 'false', 'no', 'off', '' => False
+    '''
+    value = value.strip().lower()
+    if value in ('1', 'true', 'yes', 'on'):
+        return True
+    if value in ('0', 'false', 'no', 'off', ''):
+        return False
+    raise ValueError('not a boolean: %r' % value)
+
+
+def parse_choice(*choices):
+    '''
+    converter accepting one of choices only
+    '''
+
+    def parse(value):
+        if value not in choices:
+            raise ValueError('not one of %s: %r' % (', '.join(choices), value))
+        return str(value)
+
+    return parse
+
+
+class AdminJobHandler(BaseHandler):
+
+    '''
+    start one-off maintenance jobs (admin only, see app.yaml)
+    '''
+
+    # job name => (function run in the background by deferred,
+    #              {parameter name: converter of the request param})
+    JOBS = {
+        'backfill_like_counters': (
+            CounterHelper.backfill_like_counters, dict(cursor=str)),
+        'check_like_counters': (
+            CounterHelper.check_like_counters,
+            dict(cursor=str, repair=parse_bool)),
+        'rebuild_comment_summaries': (
+            CommentHelper.rebuild_comment_summaries, dict(cursor=str)),
+        'migrate_users': (
+            UserHelper.migrate_users,
+            dict(cursor=str, delete_legacy=parse_bool)),
+        'migrate_likes': (LikeHelper.migrate_likes, dict(cursor=str)),
+        'backfill_post_html': (
+            PostHelper.backfill_post_html, dict(cursor=str)),
+        'sweep_orphans': (
+            PostHelper.sweep_orphans,
+            dict(kind=parse_choice('Comment', 'Like', 'LikeCounterShard'),
+                 cursor=str)),
+        'rebuild_search_index': (
+            SearchHelper.rebuild_search_index, dict(cursor=str)),
+        'sweep_search_index': (SearchHelper.sweep_search_index, dict()),
+        'migrate_entity_groups': (
+            PostHelper.migrate_entity_groups, dict(cursor=str)),
+    }
+
+    def get(self, job_name=None):
+        '''
+        list available jobs
+        '''
+        self.response.headers['Content-Type'] = 'text/plain'
+        self.write('\n'.join(sorted(self.JOBS)))
+
+    def post(self, job_name):
+        '''
+        defer the job, request params are converted and passed on as
+        keyword arguments, unknown or malformed params are rejected
+        '''
+        if job_name not in self.JOBS:
+            self.error(404)
+            self.write('Error! Job Not Found')
+            return
+        job, converters = self.JOBS[job_name]
+
+        self.response.headers['Content-Type'] = 'text/plain'
+        params = {}
+        for name in self.request.arguments():
+            if name not in converters:
+                self.error(400)
+                self.write('Error! Unknown Parameter %s' % name)
+                return
+            try:
+                params[str(name)] = converters[name](self.request.get(name))
+            except ValueError as error:
+                self.error(400)
+                self.write('Error! Bad Parameter %s: %s' % (name, error))
+                return
+
+        deferred.defer(job, **params)
+        self.write('%s started' % job_name)
@@ -0,0 +1,40 @@
+import datetime
+
+from BlogFrontHandler import BlogFrontHandler
+from helpers import PageCacheHelper
+from helpers import PostHelper
+
+
+class ArchiveHandler(BlogFrontHandler):
+
+    '''
+    blog archive, list of months and the posts of a month
+    '''
+
+    @PageCacheHelper.cached_page
+    def get(self, year=None, month=None):
+        '''
+        without year and month render the list of months using
+        archive.html, else render the month's posts like the front page
+        '''
+        if not year:
+            months = [datetime.date(y, m, 1)
+                      for y, m in PostHelper.get_archive_months()]
+            self.render('archive.html', months=months, user=self.user)
+            return
+
+        try:
+            # months outside what datetime represents (year 0, December
+            # 9999) are not found either
+            start, end = PostHelper.get_month_range(int(year), int(month))
+        except ValueError:
+            self.error(404)
+            self.write('Error! Month Not Found')
+            return
+
+        year, month = start.year, start.month
+        self.render_posts_page(
+            page_url='/archive/%04d/%02d' % (year, month),
+            start=start,
+            end=end,
+            heading=start.strftime('%B %Y'))
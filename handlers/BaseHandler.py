@@ -1,15 +1,9 @@
 # how do i import webapp2 here?
 # should'nt it be available already??
 
-import os
-import jinja2
 import webapp2
-
-# build path to templates directory
-template_dir = os.path.join(os.path.dirname(__file__), "../templates")
-# initialize jinja environment
-jinja_env = jinja2.Environment(
-    loader=jinja2.FileSystemLoader(template_dir), autoescape=True)
+import config
+from helpers import TemplateHelper
 
 
 class BaseHandler(webapp2.RequestHandler):
@@ -28,11 +22,14 @@ class BaseHandler(webapp2.RequestHandler):
         '''
         return html output to render, as a string
         '''
-        t = jinja_env.get_template(template)
-        return t.render(params)
+        return TemplateHelper.render_str(template, **params)
 
     def render(self, template, **kw):
         '''
-        render html
+        render html, with config.STREAM_TEMPLATES the page is rendered
+        while it is sent (after the handler returns), so render last
         '''
-        self.response.out.write(self.render_str(template, **kw))
+        if config.STREAM_TEMPLATES:
+            self.response.app_iter = TemplateHelper.Stream(template, kw)
+        else:
+            self.response.out.write(self.render_str(template, **kw))
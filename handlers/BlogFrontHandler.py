@@ -1,6 +1,10 @@
+import logging
+
+import config
 from BlogHandler import BlogHandler
+from helpers import PageCacheHelper
 from helpers import PostHelper
-from google.appengine.ext import db
+from helpers import RpcHelper
 
 
 class BlogFrontHandler(BlogHandler):
@@ -9,16 +13,40 @@ class BlogFrontHandler(BlogHandler):
     blog front page, with recent 10 posts
     '''
 
+    @PageCacheHelper.cached_page
     def get(self):
         '''
-        get 10 recent posts from Post entity and render them using front.html
-        note: doing this by using gql for practice
+        get a page of recent posts (10 per page) from Post entity and
+        render them using front.html, ?c=<cursor> selects the page
+        '''
+        self.render_posts_page(page_url='/')
+
+    def render_posts_page(self, page_url, start=None, end=None, **params):
         '''
+        render a page of posts created in [start, end) using front.html
+        '''
+        with RpcHelper.RpcCounter() as rpcs:
+            # fetch posts from db
+            posts, newer_cursor, older_cursor = PostHelper.get_posts_page(
+                self.request.get('c'), start, end)
+
+            if config.STREAM_TEMPLATES:
+                # rendered while the page streams, after the header is
+                # sent (so the rpcs counted leave out the likes data)
+                posts_html = PostHelper.generate_posts(posts, self.user)
+            else:
+                # render all posts in one batch
+                posts_html = PostHelper.render_posts(posts, self.user)
 
-        # fetch posts from db
-        posts = db.GqlQuery(
-            "select * from Post order by created desc limit 10")
+        logging.info('%s: %d posts fetched with %d datastore rpcs',
+                     page_url, len(posts), rpcs.count)
+        self.response.headers['X-Datastore-Rpcs'] = str(rpcs.count)
 
         # render front page
-        self.render(
-            'front.html', posts=posts, user=self.user, post_helper=PostHelper)
+        self.render('front.html',
+                    posts_html=posts_html,
+                    page_url=page_url,
+                    newer_cursor=newer_cursor,
+                    older_cursor=older_cursor,
+                    user=self.user,
+                    **params)
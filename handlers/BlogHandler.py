@@ -1,15 +1,10 @@
 import webapp2
-import hmac
-import os
 from BaseHandler import BaseHandler
 from helpers import BlogHelper
+from helpers import SessionHelper
 from helpers import UserHelper
 from models import User
 
-current_path = os.getcwd()
-file_path = current_path + '/secret.txt'
-SECRET = open(file_path, 'r').read()
-
 
 class BlogHandler(BaseHandler):
 
@@ -26,8 +21,39 @@ class BlogHandler(BaseHandler):
         webapp2.RequestHandler.initialize(
             self, *a, **kw)  # required, don't know why
 
+        # self.user is a SessionHelper.Principal (or None),
+        # use self.user_entity when the User entity is needed
+        self._user_entity = None
+        self.user = self.get_session_user()
+
+    def get_session_user(self):
+        '''
+        return principal of the logged in user from the session token,
+        falls back to the legacy user_id cookie (id|hmac)
+        '''
+        token = self.request.cookies.get(SessionHelper.SESSION_COOKIE)
+        principal = token and SessionHelper.parse_token(token)
+        if principal:
+            return principal
+
+        # legacy cookie, load the user once and upgrade to a session token
         user_id = self.get_cookie('user_id')
-        self.user = user_id and UserHelper.get_user_by_id(int(user_id))
+        user = user_id and UserHelper.get_user_by_id(int(user_id))
+        if user:
+            self._user_entity = user
+            return SessionHelper.parse_token(self.set_session(user))
+
+    @property
+    def user_entity(self):
+        '''
+        User entity of the logged in user, loaded on first use
+        '''
+        if self.user and not self._user_entity:
+            self._user_entity = (
+                UserHelper.get_user_by_id(self.user.user_id) or
+                # tokens issued before migrate_users carry the old id
+                UserHelper.get_user_by_name(self.user.username))
+        return self._user_entity
 
     def set_cookie(self, cookie_name, cookie_val):
         '''
@@ -48,17 +74,36 @@ class BlogHandler(BaseHandler):
         cookie_val = self.request.cookies.get(cookie_name)
         return cookie_val and BlogHelper.verify_secure_cookie_val(cookie_val)
 
+    def set_session(self, user):
+        '''
+        set session token cookie for user (user object),
+        returns the token
+        '''
+        token = SessionHelper.make_token(
+            user.key.id(), user.username)
+        self.response.headers.add_header(
+            'Set-Cookie', '%s=%s; Path=/; Max-Age=%d; HttpOnly' % (
+                SessionHelper.SESSION_COOKIE, token,
+                SessionHelper.SESSION_LIFETIME))
+        return token
+
     def login(self, user):
         '''
         login user by setting cookie
         user = user object
         '''
-        self.set_cookie('user_id', user.key().id())
+        self.set_session(user)
+        # legacy cookie, keeps users with numeric ids logged in if we roll
+        # back, remove once every version reads session tokens
+        if user.key.integer_id():
+            self.set_cookie('user_id', user.key.integer_id())
 
     def logout(self):
         '''
         logout user by clearing cookie
         '''
+        self.response.headers.add_header(
+            'Set-Cookie', '%s=; Path=/' % SessionHelper.SESSION_COOKIE)
         self.response.headers.add_header('Set-Cookie', 'user_id=; Path=/')
 
     def register(self, username, password, email=None):
@@ -70,7 +115,9 @@ class BlogHandler(BaseHandler):
         password_hash = BlogHelper.hash_str(password)
 
         # create and return user (this does not update database)
-        return User(parent=UserHelper.get_users_key(),
+        # users are keyed by username, see UserHelper.put_new_user
+        return User(id=username,
+                    parent=UserHelper.get_users_key(),
                     username=username,
                     password_hash=password_hash,
                     email=email)
@@ -0,0 +1,31 @@
+from BlogHandler import BlogHandler
+from helpers import CommentHelper
+from helpers import PageCacheHelper
+from helpers import PostHelper
+
+
+class CommentsHandler(BlogHandler):
+
+    '''
+    a page of comments of a post as an html fragment,
+    loaded in place by static/comments.js
+    '''
+
+    @PageCacheHelper.cached_post_page
+    def get(self, post_id):
+        '''
+        render the comments page after ?cursor= using comments.html
+        '''
+        comments_future = CommentHelper.get_comments_page_async(
+            post_id, self.request.get('cursor'))
+
+        if not PostHelper.get_post_by_id(post_id):
+            self.error(404)
+            self.write('Error! Post Not Found')
+            return
+
+        comments, comments_cursor = comments_future.get_result()
+        self.render("comments.html",
+                    comments=comments,
+                    comments_cursor=comments_cursor,
+                    post_id=int(post_id))
@@ -1,7 +1,7 @@
-from handlers import BlogHandler
-from models import Comment
+from BlogHandler import BlogHandler
 from helpers import CommentHelper
 from helpers import PostHelper
+from helpers import PageCacheHelper
 
 
 class DeleteCommentHandler(BlogHandler):
@@ -15,9 +15,9 @@ class DeleteCommentHandler(BlogHandler):
         render delete comment form
         '''
         post = PostHelper.get_post_by_id(post_id)
-        comment = CommentHelper.get_comment_by_id(comment_id)
+        comment = CommentHelper.get_comment_by_id(comment_id, post_id)
 
-        if not post and comment:
+        if not (post and comment):
             self.redirect('/')
             return
 
@@ -44,9 +44,9 @@ class DeleteCommentHandler(BlogHandler):
     def post(self, comment_id, post_id):
 
         post = PostHelper.get_post_by_id(post_id)
-        comment = CommentHelper.get_comment_by_id(comment_id)
+        comment = CommentHelper.get_comment_by_id(comment_id, post_id)
 
-        if not post and comment:
+        if not (post and comment):
             self.redirect('/')
             return
 
@@ -61,7 +61,8 @@ class DeleteCommentHandler(BlogHandler):
             return
 
         if comment.username == self.user.username:
-            # delete comment from db
-            comment.delete()
+            # delete comment from db and update the post's comments summary
+            CommentHelper.delete_comment(comment)
+            PageCacheHelper.invalidate_post(post_id)
             self.redirect('/post/%s' % str(post_id))
             return
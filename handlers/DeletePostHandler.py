@@ -1,7 +1,7 @@
-from handlers import BlogHandler
-from models import Post
+from BlogHandler import BlogHandler
 from helpers import PostHelper
-from google.appengine.ext import db
+from helpers import PageCacheHelper
+from helpers import SearchHelper
 
 
 class DeletePostHandler(BlogHandler):
@@ -25,9 +25,6 @@ class DeletePostHandler(BlogHandler):
             self.redirect('/')
             return
 
-        # replace <br> with new lines
-        post.content = post.content.replace('<br>', '\n')
-
         if self.user.username != post.username:
             # render permission denied form
             error = "not your post to delete!"
@@ -35,7 +32,8 @@ class DeletePostHandler(BlogHandler):
                 "permissiondenied.html", error=error, user=self.user)
             return
         else:
-            # render delete post form
+            # render delete post form, with the source text of legacy posts
+            PostHelper.fill_content_html(post)
             self.render("deletepost.html", user=self.user, post=post)
             return
 
@@ -57,15 +55,13 @@ class DeletePostHandler(BlogHandler):
         subject = self.request.get('subject')
         content = self.request.get('content')
 
-        # get post key by id
-        postkey = db.Key.from_path(
-            'Post', int(post_id), parent=PostHelper.get_posts_key())
-
         if username and subject and content:
             if username == post.username:
-                # delete post (post key) from db
-                db.delete(postkey)
-                # TODO: post.delete() is also working find the difference
+                # delete post from db, its comments and likes are
+                # deleted in the background
+                PostHelper.delete_post(post_id)
+                SearchHelper.unindex_post(post_id)
+                PageCacheHelper.invalidate_post(post_id, requery=True)
                 self.redirect('/postdeleted')
                 # self.redirect('/')
                 # TODO: clarify, why is this showing post on home page?
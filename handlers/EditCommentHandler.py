@@ -1,7 +1,7 @@
-from handlers import BlogHandler
-from models import Comment
+from BlogHandler import BlogHandler
 from helpers import CommentHelper
 from helpers import PostHelper
+from helpers import PageCacheHelper
 
 
 class EditCommentHandler(BlogHandler):
@@ -15,9 +15,9 @@ class EditCommentHandler(BlogHandler):
         render edit comment form
         '''
         post = PostHelper.get_post_by_id(post_id)
-        comment = CommentHelper.get_comment_by_id(comment_id)
+        comment = CommentHelper.get_comment_by_id(comment_id, post_id)
 
-        if not post and comment:
+        if not (post and comment):
             self.redirect('/')
             return
 
@@ -37,9 +37,9 @@ class EditCommentHandler(BlogHandler):
 
     def post(self, comment_id, post_id):
         post = PostHelper.get_post_by_id(post_id)
-        comment = CommentHelper.get_comment_by_id(comment_id)
+        comment = CommentHelper.get_comment_by_id(comment_id, post_id)
 
-        if not post and comment:
+        if not (post and comment):
             self.redirect('/')
             return
 
@@ -59,9 +59,9 @@ class EditCommentHandler(BlogHandler):
             return
 
         if username and newedit:
-            # put comment on db
-            comment.comment = str(newedit)
-            comment.put()
+            # put comment on db and update the post's comments summary
+            CommentHelper.edit_comment(comment, str(newedit))
+            PageCacheHelper.invalidate_post(post_id)
             self.redirect('/post/%s' % str(post_id))
             return
         else:
@@ -1,6 +1,7 @@
-from handlers import BlogHandler
-from models import Post
+from BlogHandler import BlogHandler
 from helpers import PostHelper
+from helpers import PageCacheHelper
+from helpers import SearchHelper
 
 
 class EditPostHandler(BlogHandler):
@@ -24,9 +25,6 @@ class EditPostHandler(BlogHandler):
             self.redirect('/')
             return
 
-        # replace <br> in post content with new lines
-        post.content = post.content.replace('<br>', '\n')
-
         if self.user.username != post.username:
             # render permission denied form
             error = "not your post to edit!"
@@ -34,7 +32,8 @@ class EditPostHandler(BlogHandler):
                 "permissiondenied.html", error=error, user=self.user)
             return
 
-        # render edit post form
+        # render edit post form, with the source text of legacy posts
+        PostHelper.fill_content_html(post)
         self.render("editpost.html", user=self.user, post=post)
         return
 
@@ -55,16 +54,13 @@ class EditPostHandler(BlogHandler):
         content = self.request.get('content')
 
         if username and subject and content:
-            # replace subject with new subject
-            post.subject = subject
-
-            # replace content with new content
-            # replace new lines with <br>
-            post.content = content.replace('\n', '<br>')
-
+            # the cached post is only used for the permission check
             if username == post.username:
-                # put edited post on db
-                post.put()
+                # put edited post on db (and its html)
+                post = PostHelper.edit_post(post.key, subject, content)
+                if post:
+                    SearchHelper.index_post(post)
+                PageCacheHelper.invalidate_post(post_id, requery=True)
 
                 # redirect to post page
                 self.redirect('/post/%s' % str(post_id))
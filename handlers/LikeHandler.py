@@ -1,7 +1,6 @@
-from models import Like
-from models import Post
-from handlers import BlogHandler
+from BlogHandler import BlogHandler
 from helpers import LikeHelper
+from helpers import PageCacheHelper
 from helpers import PostHelper
 
 
@@ -25,21 +24,11 @@ class LikeHandler(BlogHandler):
 
         username = self.user.username
 
-        # get user's likes for post (can be more than 1, bugs??)
-        likes_of_user = LikeHelper.get_postlikes_by_username(post_id, username)
-
-        if likes_of_user.count():
-            self.redirect('/post/%s' % str(post_id))
-            return
-
         if username != post.username:
-            # build like object
-            like = Like(parent=LikeHelper.get_likes_key(),
-                        post_id=post_id,
-                        username=username, like=True)
-
-            # put like on db
-            like.put()
+            # put like on db and update the post's likes counter
+            # (does nothing if the user already likes the post)
+            LikeHelper.add_like(post_id, username)
+            PageCacheHelper.invalidate_post(post_id)
 
         self.redirect('/post/%s' % str(post_id))
         return
@@ -1,6 +1,5 @@
-from handlers import BlogHandler
+from BlogHandler import BlogHandler
 from helpers import BlogHelper, UserHelper
-from models import User
 
 
 class LoginHandler(BlogHandler):
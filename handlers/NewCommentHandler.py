@@ -1,8 +1,7 @@
-from models import Comment
-from models import Post
-from handlers import BlogHandler
+from BlogHandler import BlogHandler
 from helpers import PostHelper
 from helpers import CommentHelper
+from helpers import PageCacheHelper
 
 
 class NewCommentHandler(BlogHandler):
@@ -45,14 +44,9 @@ class NewCommentHandler(BlogHandler):
         comment = self.request.get('comment')
 
         if username and comment:
-            # build comment object
-            c = Comment(
-                parent=CommentHelper.get_comments_key(),
-                username=username, post_id=post_id,
-                comment=comment
-            )
-            # put comment on db
-            c.put()
+            # put comment on db and update the post's comments summary
+            CommentHelper.add_comment(post_id, username, comment)
+            PageCacheHelper.invalidate_post(post_id)
 
             self.redirect('/post/%s' % str(post_id))
             return
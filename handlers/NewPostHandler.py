@@ -1,6 +1,8 @@
 from BlogHandler import BlogHandler
 from models import Post
 from helpers import PostHelper
+from helpers import PageCacheHelper
+from helpers import SearchHelper
 
 
 class NewPostHandler(BlogHandler):
@@ -29,14 +31,18 @@ class NewPostHandler(BlogHandler):
 
         if username and subject and content:
             # build post object
-            p = Post(parent=PostHelper.get_posts_key(),
-                     username=username, subject=subject, content=content)
+            p = Post(key=PostHelper.allocate_post_key(),
+                     username=username, subject=subject)
+            PostHelper.set_post_content(p, content)
 
             # put post in db
             p.put()
+            PostHelper.invalidate_post(p.key.id())
+            SearchHelper.index_post(p)
+            PageCacheHelper.invalidate_post(p.key.id(), requery=True)
 
             # redirect to post page
-            self.redirect('/post/%s' % str(p.key().id()))
+            self.redirect('/post/%s' % str(p.key.id()))
             return
         else:
             error = "subject and content, please!"
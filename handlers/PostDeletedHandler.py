@@ -1,4 +1,4 @@
-from handlers import BlogHandler
+from BlogHandler import BlogHandler
 
 
 class PostDeletedHandler(BlogHandler):
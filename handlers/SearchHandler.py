@@ -0,0 +1,31 @@
+import config
+from BlogHandler import BlogHandler
+from helpers import PageCacheHelper
+from helpers import PostHelper
+from helpers import SearchHelper
+
+
+class SearchHandler(BlogHandler):
+
+    '''
+    search posts, ?q=<query>
+    '''
+
+    @PageCacheHelper.cached_page
+    def get(self):
+        '''
+        render the posts best matching the query using search.html
+        '''
+        query = self.request.get('q').strip()
+
+        posts = SearchHelper.get_search_results(query) if query else []
+        if config.STREAM_TEMPLATES:
+            # rendered while the page streams, after the header is sent
+            posts_html = PostHelper.generate_posts(posts, self.user)
+        else:
+            posts_html = PostHelper.render_posts(posts, self.user)
+
+        self.render('search.html',
+                    query=query,
+                    posts_html=posts_html,
+                    user=self.user)
@@ -1,7 +1,6 @@
 from BlogHandler import BlogHandler
 from helpers import BlogHelper
 from helpers import UserHelper
-from models import User
 
 
 class SignupHandler(BlogHandler):
@@ -51,16 +50,15 @@ class SignupHandler(BlogHandler):
             user = self.register(username, password, email)
 
             # check if user exists
-            user_check = UserHelper.get_user_by_name(user.username)
-
+            # (put_new_user checks it again inside a transaction)
             # if user exists,
             # render form with error
             # else, put in db
-            if user_check:
+            if (UserHelper.get_user_by_name(user.username) or
+                    not UserHelper.put_new_user(user)):
                 params['error_username'] = ("User already exists! " +
                                             "Please enter a unique username.")
                 self.render('signup-form.html', user=self.user, **params)
             else:
-                user.put()
                 self.login(user)
                 self.redirect('/')
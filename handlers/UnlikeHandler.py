@@ -1,7 +1,6 @@
-from models import Like
-from models import Post
-from handlers import BlogHandler
+from BlogHandler import BlogHandler
 from helpers import LikeHelper
+from helpers import PageCacheHelper
 from helpers import PostHelper
 
 
@@ -13,6 +12,7 @@ class UnlikeHandler(BlogHandler):
     def get(self, post_id):
         if not self.user:
             self.redirect('/login')
+            return
 
         # get post using post id
         post = PostHelper.get_post_by_id(post_id)
@@ -21,22 +21,10 @@ class UnlikeHandler(BlogHandler):
             self.redirect('/')
             return
 
-        username = self.user.username
-
-        # get user's likes for post (can be more than 1, bugs??)
-        likes_of_user = LikeHelper.get_postlikes_by_username(post_id, username)
-
-        if not likes_of_user.count():
-            self.redirect('/post/%s' % str(post_id))
-            return
-
-        # get first like object
-        # (in case of multiple, due to bugs?)
-        like = likes_of_user[0]
-
-        if like.username == username:
-            # delete like from db
-            like.delete()
+        # delete like from db and update the post's likes counter
+        # (does nothing if the user does not like the post)
+        LikeHelper.remove_like(post_id, self.user.username)
+        PageCacheHelper.invalidate_post(post_id)
 
         self.redirect('/post/%s' % str(post_id))
         return
@@ -1,5 +1,6 @@
-from handlers import BlogHandler
+from BlogHandler import BlogHandler
 from helpers import PostHelper
+from helpers import PageCacheHelper
 
 
 class ViewPostHandler(BlogHandler):
@@ -7,6 +8,7 @@ class ViewPostHandler(BlogHandler):
     Handle Post Page (permalink)
     '''
 
+    @PageCacheHelper.cached_post_page
     def get(self, post_id):
         '''
         get post from database and render it using template
@@ -29,4 +31,6 @@ class ViewPostHandler(BlogHandler):
         self.render("permalink.html",
                     post=post,
                     user=self.user,
+                    all_comments=self.request.get('comments') == 'all',
+                    comments_cursor=self.request.get('cursor'),
                     post_helper=PostHelper)
@@ -1,16 +1,3 @@
-from BaseHandler import BaseHandler
-from BlogHandler import BlogHandler
-from BlogFrontHandler import BlogFrontHandler
-from SignupHandler import SignupHandler
-from LoginHandler import LoginHandler
-from LogoutHandler import LogoutHandler
-from LikeHandler import LikeHandler
-from UnlikeHandler import UnlikeHandler
-from NewCommentHandler import NewCommentHandler
-from EditCommentHandler import EditCommentHandler
-from DeleteCommentHandler import DeleteCommentHandler
-from NewPostHandler import NewPostHandler
-from ViewPostHandler import ViewPostHandler
-from EditPostHandler import EditPostHandler
-from DeletePostHandler import DeletePostHandler
-from PostDeletedHandler import PostDeletedHandler
+# handlers are not imported here, blog.py refers to them by import path,
+# so each handler module is imported when its route is first used
+# (keeps instance cold starts short)
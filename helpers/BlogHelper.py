@@ -2,16 +2,29 @@ import re
 import hmac
 import os
 
-current_path = os.getcwd()
-file_path = current_path + '/secret.txt'
-SECRET = open(file_path, 'r').read()
+from google.appengine.ext import ndb
+
+_secret = None
+
+
+def get_secret():
+    '''
+    blog secret (secret.txt), read on first use
+    '''
+    global _secret
+    if _secret is None:
+        current_path = os.getcwd()
+        file_path = current_path + '/secret.txt'
+        with open(file_path, 'r') as secret_file:
+            _secret = secret_file.read()
+    return _secret
 
 
 def blog_key(name='default'):
     '''
     define a parent (blog name) for all of our blog data
     '''
-    return db.Key.from_path('blogs', name)
+    return ndb.Key('blogs', name)
     # this is getting a random key based on the text 'blogs'
     # change blogs to something else and the key is changing
     # call this function and print the key to observe this
@@ -41,7 +54,7 @@ def hash_str(string_to_hash):
     hash string by using hmac & secret
     '''
     string_to_hash = str(string_to_hash)
-    return hmac.new(SECRET, string_to_hash).hexdigest()
+    return hmac.new(get_secret(), string_to_hash).hexdigest()
     # return hashlib.md5(string_to_hash).hexdigest()
 
 
@@ -0,0 +1,191 @@
+import collections
+import threading
+import time
+
+from google.appengine.api import memcache
+from google.appengine.datastore import entity_pb
+from google.appengine.ext import ndb
+
+# entities kept in the per instance cache
+LOCAL_MAX_ENTRIES = 1000
+
+# seconds an entity lives in the per instance cache
+LOCAL_TTL = 30
+
+# memcache key of the cache generation, every invalidation increments
+# it and instances clear their local cache when it changed
+GENERATION_KEY = 'entitycache:generation'
+
+# seconds between checks of the generation, writes made on other
+# instances are seen after at most this long
+GENERATION_CHECK_INTERVAL = 1
+
+# cached value of an entity that does not exist
+MISSING = '-'
+
+# kinds whose missing entities are not cached: their keys are chosen
+# by visitors (usernames), who may create them right after a lookup
+NO_NEGATIVE_CACHE_KINDS = ('User',)
+
+
+class LRUCache(object):
+
+    '''
+    thread safe least recently used cache with a time to live
+    '''
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        '''
+        return cached value, or None if it is not cached (or expired)
+        '''
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.time():
+                return None
+            # re-insert to mark as most recently used
+            self.entries[key] = entry
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (value, time.time() + self.ttl)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                count('evictions')
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+_stats = collections.defaultdict(int)
+_stats_lock = threading.Lock()
+
+_local_cache = LRUCache(LOCAL_MAX_ENTRIES, LOCAL_TTL)
+
+# generation the local cache is valid for, and when it was checked
+_generation = dict(value=None, checked=0.0)
+_generation_lock = threading.Lock()
+
+
+def count(stat):
+    '''
+    increment a cache statistics counter
+    '''
+    with _stats_lock:
+        _stats[stat] += 1
+
+
+def get_stats():
+    '''
+    cache statistics of this instance (dict)
+    '''
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['local_entries'] = len(_local_cache.entries)
+    stats['local_max_entries'] = LOCAL_MAX_ENTRIES
+    return stats
+
+
+def check_generation():
+    '''
+    clear the local cache if entities were invalidated (on any instance)
+    since the last check, checks at most every GENERATION_CHECK_INTERVAL
+    seconds
+    '''
+    now = time.time()
+    with _generation_lock:
+        if now - _generation['checked'] < GENERATION_CHECK_INTERVAL:
+            return
+        _generation['checked'] = now
+
+    value = memcache.get(GENERATION_KEY)
+    with _generation_lock:
+        if value != _generation['value']:
+            _generation['value'] = value
+            _local_cache.clear()
+            count('generation_clears')
+
+
+def get_cache_key(key):
+    return 'entity:%s' % key.urlsafe()
+
+
+def encode_entity(entity):
+    '''
+    serialize entity for the cache (MISSING if there is no entity)
+    '''
+    if entity is None:
+        return MISSING
+    return ndb.ModelAdapter().entity_to_pb(entity).Encode()
+
+
+def decode_entity(value):
+    if value == MISSING:
+        return None
+    return ndb.ModelAdapter().pb_to_entity(entity_pb.EntityProto(value))
+
+
+@ndb.tasklet
+def get_async(key):
+    '''
+    get entity by key, from the per instance cache, then through ndb
+    (which caches entities in memcache and keeps it consistent with the
+    datastore), asynchronously (returns a future). entities are cached
+    serialized, so every caller gets its own copy. returns None (also
+    cached, except for NO_NEGATIVE_CACHE_KINDS) if there is no entity.
+    '''
+    # reads inside a transaction must go to the datastore
+    if ndb.in_transaction():
+        entity = yield key.get_async()
+        raise ndb.Return(entity)
+
+    check_generation()
+    cache_key = get_cache_key(key)
+
+    value = _local_cache.get(cache_key)
+    if value is None:
+        count('misses')
+        entity = yield key.get_async()
+        if entity or key.kind() not in NO_NEGATIVE_CACHE_KINDS:
+            _local_cache.set(cache_key, encode_entity(entity))
+        raise ndb.Return(entity)
+
+    count('local_hits')
+    if value == MISSING:
+        count('negative_hits')
+    raise ndb.Return(decode_entity(value))
+
+
+def get(key):
+    '''
+    get entity by key (see get_async)
+    '''
+    return get_async(key).get_result()
+
+
+def invalidate(*keys):
+    '''
+    remove entities from the per instance cache, call this after writing
+    them (ndb clears its memcache entries on put and delete). the cache
+    generation is incremented, so the other instances clear their local
+    cache within GENERATION_CHECK_INTERVAL seconds
+    '''
+    for key in keys:
+        _local_cache.delete(get_cache_key(key))
+    memcache.incr(GENERATION_KEY, initial_value=0)
+    count('invalidations')
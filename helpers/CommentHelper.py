@@ -1,30 +1,289 @@
-from google.appengine.ext import db
+import logging
+
+from google.appengine.api.datastore_errors import BadValueError
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import deferred
+from google.appengine.ext import ndb
 from models.Comment import Comment
+import CacheHelper
+import PostHelper
+
+# number of comments kept in the post's latest comments summary
+LATEST_COMMENTS = 5
+
+# posts processed per task by the rebuild job
+JOB_BATCH_SIZE = 50
+
+# comments per page of a comments thread
+COMMENTS_PAGE_SIZE = 50
+
+# comments fetched per datastore round trip, one more than a page so
+# a page and the check for a next page take a single round trip
+COMMENTS_BATCH_SIZE = COMMENTS_PAGE_SIZE + 1
+
+# prefix of comments page cursors of legacy comments
+LEGACY_CURSOR_PREFIX = 'legacy-'
 
 
 def get_comments_key(name='default'):
     '''
-    define a parent group 'comments' identified by 'default'
-    useful for attaching data of all comments
+    define a parent group 'comments' identified by 'default',
+    the parent of legacy comments (see PostHelper.LEGACY_ENTITY_GROUPS).
+    ids of new comments are allocated from it, so they never clash with
+    the ids of legacy comments
     '''
-    return db.Key.from_path('comments', name)
+    return ndb.Key('comments', name)
 
 
 def get_comments_for_post(post_id):
     '''
-    get all comments for a post
+    get all comments for a post (stored under the post)
+    '''
+    return Comment.query(ancestor=PostHelper.get_post_key(post_id))
+
+
+def get_legacy_comments_for_post(post_id):
+    '''
+    get the comments of a post written before comments were stored
+    under their post
     '''
     post_id = str(post_id)
-    comments = Comment.all().filter(
-        'post_id = ', post_id).ancestor(get_comments_key())
+    comments = Comment.query(ancestor=get_comments_key()).filter(
+        Comment.post_id == post_id)
+    return comments
+
+
+def parse_cursor(cursor):
+    try:
+        return Cursor(urlsafe=cursor) if cursor else None
+    except (BadValueError, TypeError):
+        return None
+
+
+@ndb.tasklet
+def get_comments_page_async(post_id, cursor=None,
+                            page_size=COMMENTS_PAGE_SIZE):
+    '''
+    get a page of comments of a post, oldest first, asynchronously.
+    returns a future of (comments, cursor of the next page or None),
+    an invalid cursor starts from the first page.
+    legacy comments are all older than the comments stored under the
+    post, so they are paged through first
+    '''
+    post_id = str(post_id)
+    cursor = cursor or ''
+    legacy = PostHelper.LEGACY_ENTITY_GROUPS and (
+        not cursor or cursor.startswith(LEGACY_CURSOR_PREFIX))
+    start_cursor = parse_cursor(cursor[len(LEGACY_CURSOR_PREFIX):]
+                                if legacy else cursor)
+
+    comments = []
+    if legacy:
+        query = get_legacy_comments_for_post(post_id).order(Comment.created)
+        comments, next_cursor, more = yield query.fetch_page_async(
+            page_size, start_cursor=start_cursor,
+            batch_size=COMMENTS_BATCH_SIZE)
+        if len(comments) == page_size and next_cursor:
+            # the next page has more legacy comments, or starts the
+            # comments stored under the post (if there are any)
+            if not more:
+                more = yield get_comments_for_post(post_id).get_async(
+                    keys_only=True)
+            next_cursor = LEGACY_CURSOR_PREFIX + next_cursor.urlsafe()
+            raise ndb.Return((comments, next_cursor if more else None))
+        start_cursor = None
+
+    page_size -= len(comments)
+    query = get_comments_for_post(post_id).order(Comment.created)
+    page, next_cursor, more = yield query.fetch_page_async(
+        page_size, start_cursor=start_cursor, batch_size=page_size + 1)
+    raise ndb.Return((comments + page,
+                      next_cursor.urlsafe() if more and next_cursor else None))
+
+
+def get_comment_key(comment_id, post_id):
+    '''
+    get comment key by comment and post id
+    '''
+    return ndb.Key('Comment', int(comment_id),
+                   parent=PostHelper.get_post_key(post_id))
+
+
+def get_legacy_comment_key(comment_id):
+    '''
+    get key of a comment written before comments were stored under
+    their post
+    '''
+    return ndb.Key('Comment', int(comment_id), parent=get_comments_key())
+
+
+def get_comment_by_id(comment_id, post_id):
+    '''
+    get comment object by comment and post id (cached, see CacheHelper)
+    '''
+    comment = CacheHelper.get(get_comment_key(comment_id, post_id))
+    if not comment and PostHelper.LEGACY_ENTITY_GROUPS:
+        comment = CacheHelper.get(get_legacy_comment_key(comment_id))
+    return comment
+
+
+def get_comment_summary(comment):
+    '''
+    summary of a comment, as stored in the post's latest comments
+    '''
+    return dict(id=comment.key.id(),
+                post_id=comment.post_id,
+                username=comment.username,
+                comment=comment.comment,
+                created=comment.created.strftime("%b %d, %Y"))
+
+
+def get_latest_comments_for_post(post_id, limit=LATEST_COMMENTS):
+    '''
+    query the latest comments of a post, newest first
+    '''
+    comments = get_comments_for_post(post_id).order(
+        -Comment.created).fetch(limit)
+    if len(comments) < limit and PostHelper.LEGACY_ENTITY_GROUPS:
+        # legacy comments are older than all others
+        comments.extend(get_legacy_comments_for_post(post_id).order(
+            -Comment.created).fetch(limit - len(comments)))
     return comments
 
 
-def get_comment_by_id(comment_id):
+def count_comments_for_post(post_id):
     '''
-    get comment object by comment id
+    count Comment entities of a post
     '''
-    return Comment.get_by_id(
-        int(comment_id),
-        parent=get_comments_key()
-    )
+    count = get_comments_for_post(post_id).count()
+    if PostHelper.LEGACY_ENTITY_GROUPS:
+        count += get_legacy_comments_for_post(post_id).count()
+    return count
+
+
+def run_in_post_transaction(post_id, update):
+    '''
+    run update(post) in a cross group transaction (post + comments),
+    then bump the post's comment version and put the post
+    '''
+
+    def txn():
+        post = PostHelper.get_post_by_id(post_id)
+        result = update(post)
+        if post:
+            post.comment_version = (post.comment_version or 0) + 1
+            post.put()
+        return result
+
+    result = ndb.transaction(txn, xg=True)
+    PostHelper.invalidate_post(post_id)
+    return result
+
+
+def add_comment(post_id, username, text):
+    '''
+    put a new comment and update the post's comments summary
+    '''
+    post_id = str(post_id)
+    comment_id, _ = Comment.allocate_ids(1, parent=get_comments_key())
+
+    def update(post):
+        comment = Comment(key=get_comment_key(comment_id, post_id),
+                          username=username,
+                          post_id=post_id,
+                          comment=text)
+        comment.put()
+        if post:
+            post.comment_count = (post.comment_count or 0) + 1
+            latest = [get_comment_summary(comment)]
+            latest.extend(post.get_latest_comments())
+            post.set_latest_comments(latest[:LATEST_COMMENTS])
+        return comment
+
+    comment = run_in_post_transaction(post_id, update)
+    CacheHelper.invalidate(comment.key)
+    return comment
+
+
+def edit_comment(comment, text):
+    '''
+    update comment text and the post's comments summary
+    '''
+
+    def update(post):
+        comment.comment = text
+        comment.put()
+        if post:
+            latest = post.get_latest_comments()
+            for summary in latest:
+                if summary['id'] == comment.key.id():
+                    summary['comment'] = text
+            post.set_latest_comments(latest)
+        return comment
+
+    run_in_post_transaction(comment.post_id, update)
+    CacheHelper.invalidate(comment.key)
+    return comment
+
+
+def delete_comment(comment):
+    '''
+    delete comment and update the post's comments summary
+    '''
+    post_id = comment.post_id
+
+    def update(post):
+        # the comment may have been removed by a concurrent request
+        if not comment.key.get():
+            return
+        comment.key.delete()
+        if post:
+            post.comment_count = max((post.comment_count or 0) - 1, 0)
+            latest = post.get_latest_comments()
+            if comment.key.id() in [summary['id'] for summary in latest]:
+                # refill the summary, the query does not see the delete
+                # made in this transaction, so skip the deleted comment
+                candidates = get_latest_comments_for_post(
+                    post_id, LATEST_COMMENTS + 1)
+                latest = [get_comment_summary(c) for c in candidates
+                          if c.key != comment.key]
+                post.set_latest_comments(latest[:LATEST_COMMENTS])
+
+    run_in_post_transaction(post_id, update)
+    CacheHelper.invalidate(comment.key)
+
+
+def rebuild_comment_summary(post_id):
+    '''
+    rebuild comment count and latest comments of a post from its comments
+    '''
+    post_id = str(post_id)
+
+    def update(post):
+        if post:
+            post.comment_count = count_comments_for_post(post_id)
+            post.set_latest_comments(
+                [get_comment_summary(c)
+                 for c in get_latest_comments_for_post(post_id)])
+
+    run_in_post_transaction(post_id, update)
+
+
+def rebuild_comment_summaries(cursor=None):
+    '''
+    job: rebuild comments summaries of all posts,
+    runs in batches, every batch defers the next one
+    '''
+    query = PostHelper.get_posts_query()
+    post_keys, next_cursor, more = query.fetch_page(
+        JOB_BATCH_SIZE, keys_only=True,
+        start_cursor=Cursor(urlsafe=cursor) if cursor else None)
+
+    for post_key in post_keys:
+        rebuild_comment_summary(post_key.id())
+
+    logging.info('rebuild_comment_summaries: rebuilt %d posts',
+                 len(post_keys))
+
+    if more and next_cursor:
+        deferred.defer(rebuild_comment_summaries, next_cursor.urlsafe())
@@ -0,0 +1,139 @@
+import zlib
+
+import config
+import TraceHelper
+
+# content types worth compressing
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript')
+
+
+def accepts_gzip(accept_encoding):
+    '''
+    does an Accept-Encoding header value allow gzip? an explicit gzip
+    entry wins over *, q=0 refuses
+    '''
+    qualities = {}
+    for coding in (accept_encoding or '').split(','):
+        name, _, params = coding.partition(';')
+        name = name.strip().lower()
+        if name not in ('gzip', '*'):
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name] = quality
+    return qualities.get('gzip', qualities.get('*', 0.0)) > 0
+
+
+def compress(data, name='response'):
+    '''
+    gzip data (traced as a gzip call, see TraceHelper)
+    '''
+    with TraceHelper.span('gzip', name):
+        compressor = zlib.compressobj(config.COMPRESS_LEVEL, zlib.DEFLATED,
+                                      16 + zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+
+
+def compress_stream(chunks):
+    '''
+    gzip a streamed response chunk by chunk, every chunk is flushed
+    '''
+    compressor = zlib.compressobj(config.COMPRESS_LEVEL, zlib.DEFLATED,
+                                  16 + zlib.MAX_WBITS)
+    try:
+        for chunk in chunks:
+            yield (compressor.compress(chunk) +
+                   compressor.flush(zlib.Z_SYNC_FLUSH))
+        yield compressor.flush()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def get_header(headers, name):
+    for key, value in headers:
+        if key.lower() == name.lower():
+            return value
+
+
+def set_header(headers, name, value):
+    headers = [(key, old) for key, old in headers
+               if key.lower() != name.lower()]
+    headers.append((name, value))
+    return headers
+
+
+def is_compressible(status, headers):
+    content_type = get_header(headers, 'Content-Type') or ''
+    return (status.startswith('200') and
+            content_type.startswith(COMPRESSIBLE_TYPES) and
+            not get_header(headers, 'Content-Encoding'))
+
+
+def add_vary(headers):
+    vary = get_header(headers, 'Vary')
+    if vary and 'accept-encoding' in vary.lower():
+        return headers
+    return set_header(headers, 'Vary',
+                      vary + ', Accept-Encoding' if vary else
+                      'Accept-Encoding')
+
+
+class GzipMiddleware(object):
+
+    '''
+    wsgi middleware, gzips html and json responses of at least
+    config.COMPRESS_MIN_BYTES bytes for clients accepting gzip.
+    responses already encoded (gzipped pages from the page cache) are
+    passed through. streamed responses are compressed chunk by chunk
+    '''
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        response = {}
+
+        def capture_start_response(status, headers, exc_info=None):
+            response.update(status=status, headers=headers,
+                            exc_info=exc_info)
+            # the body is written through the returned iterable
+            return lambda data: None
+
+        body = self.app(environ, capture_start_response)
+        status, headers = response['status'], response['headers']
+        exc_info = response['exc_info']
+
+        if not is_compressible(status, headers):
+            start_response(status, headers, exc_info)
+            return body
+
+        headers = add_vary(headers)
+        if not accepts_gzip(environ.get('HTTP_ACCEPT_ENCODING')):
+            start_response(status, headers, exc_info)
+            return body
+
+        if get_header(headers, 'Content-Length') is None:
+            # streamed response, see config.STREAM_TEMPLATES
+            headers = set_header(headers, 'Content-Encoding', 'gzip')
+            start_response(status, headers, exc_info)
+            return compress_stream(body)
+
+        try:
+            data = ''.join(body)
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+
+        if len(data) >= config.COMPRESS_MIN_BYTES:
+            data = compress(data)
+            headers = set_header(headers, 'Content-Encoding', 'gzip')
+            headers = set_header(headers, 'Content-Length', str(len(data)))
+        start_response(status, headers, exc_info)
+        return [data]
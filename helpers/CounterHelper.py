@@ -0,0 +1,154 @@
+import logging
+import random
+
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import deferred
+from google.appengine.ext import ndb
+from models.LikeCounterShard import LikeCounterShard
+import LikeHelper
+import PostHelper
+
+# number of shards per post, every shard is its own entity group,
+# so concurrent likes on a post spread over this many groups
+NUM_SHARDS = 5
+
+# posts processed per task by the backfill and check jobs
+JOB_BATCH_SIZE = 50
+
+
+def get_shard_key(post_id, index):
+    '''
+    get key of a likes counter shard
+    '''
+    return ndb.Key('LikeCounterShard', '%s-%d' % (post_id, index))
+
+
+def get_shard_keys(post_id):
+    '''
+    get keys of all likes counter shards of a post
+    '''
+    return [get_shard_key(post_id, index) for index in range(NUM_SHARDS)]
+
+
+def increment_likes_count(post_id, delta=1):
+    '''
+    add delta to a random shard of the likes counter of a post,
+    call this inside the transaction that puts/deletes the like
+    (it has to be a cross group transaction)
+    '''
+    post_id = str(post_id)
+    index = random.randint(0, NUM_SHARDS - 1)
+    key = get_shard_key(post_id, index)
+    shard = key.get()
+    if not shard:
+        shard = LikeCounterShard(key=key, post_id=post_id)
+    shard.count += delta
+    shard.put()
+
+
+@ndb.tasklet
+def get_likes_counts_async(post_ids):
+    '''
+    get likes count for a list of posts as a dict keyed by post id,
+    asynchronously (returns a future)
+    '''
+    post_ids = [str(post_id) for post_id in post_ids]
+    keys = []
+    for post_id in post_ids:
+        keys.extend(get_shard_keys(post_id))
+    shards = yield ndb.get_multi_async(keys)
+
+    counts = dict.fromkeys(post_ids, 0)
+    for shard in shards:
+        if shard:
+            counts[shard.post_id] += shard.count
+    raise ndb.Return(counts)
+
+
+def get_likes_counts(post_ids):
+    '''
+    get likes count for a list of posts as a dict keyed by post id,
+    all shards of all posts are fetched with a single batch get
+    '''
+    return get_likes_counts_async(post_ids).get_result()
+
+
+def get_likes_count(post_id):
+    '''
+    get likes count for a post
+    '''
+    return get_likes_counts([post_id])[str(post_id)]
+
+
+def rebuild_likes_count(post_id):
+    '''
+    rebuild the likes counter of a post from its Like entities,
+    the likes are counted inside the transaction which writes the shards
+    '''
+    post_id = str(post_id)
+
+    def txn():
+        count = LikeHelper.count_likes_for_post(post_id)
+        shards = [LikeCounterShard(key=key, post_id=post_id, count=0)
+                  for key in get_shard_keys(post_id)]
+        shards[0].count = count
+        ndb.put_multi(shards)
+        return count
+
+    return ndb.transaction(txn, xg=True)
+
+
+def get_post_keys_batch(cursor):
+    '''
+    fetch a batch of post keys for the jobs,
+    returns (post keys, urlsafe cursor of the next batch or None)
+    '''
+    query = PostHelper.get_posts_query()
+    post_keys, next_cursor, more = query.fetch_page(
+        JOB_BATCH_SIZE, keys_only=True,
+        start_cursor=Cursor(urlsafe=cursor) if cursor else None)
+    return post_keys, more and next_cursor.urlsafe() or None
+
+
+def backfill_like_counters(cursor=None):
+    '''
+    job: rebuild likes counters of all posts from the existing likes,
+    runs in batches, every batch defers the next one
+    '''
+    post_keys, next_cursor = get_post_keys_batch(cursor)
+
+    for post_key in post_keys:
+        rebuild_likes_count(post_key.id())
+
+    logging.info('backfill_like_counters: rebuilt %d counters',
+                 len(post_keys))
+
+    if next_cursor:
+        deferred.defer(backfill_like_counters, next_cursor)
+
+
+def check_like_counters(cursor=None, repair=False):
+    '''
+    job: compare likes counters with the number of Like entities,
+    mismatches are logged (and rebuilt, if repair is set)
+    '''
+    post_keys, next_cursor = get_post_keys_batch(cursor)
+
+    post_ids = [str(post_key.id()) for post_key in post_keys]
+    counters = get_likes_counts(post_ids)
+    mismatches = 0
+    for post_id in post_ids:
+        actual = LikeHelper.count_likes_for_post(post_id)
+        if actual != counters[post_id]:
+            mismatches += 1
+            logging.warning(
+                'check_like_counters: post %s counter is %d, has %d likes',
+                post_id, counters[post_id], actual)
+            if repair:
+                rebuild_likes_count(post_id)
+
+    logging.info('check_like_counters: checked %d posts, %d mismatches',
+                 len(post_ids), mismatches)
+
+    if next_cursor:
+        deferred.defer(check_like_counters, next_cursor, repair)
@@ -1,13 +1,76 @@
-from google.appengine.ext import db
+import logging
+
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import deferred
+from google.appengine.ext import ndb
 from models.Like import Like
+import CounterHelper
+import PostHelper
+
+# likes are keyed by post id and username, likes created before that have
+# numeric ids and are found by a query, until migrate_likes has rewritten
+# them. set to False once the migration is done.
+LEGACY_LIKE_LOOKUP = True
+
+# likes processed per task by the migration job
+JOB_BATCH_SIZE = 200
+
+# legacy likes of a user read per rpc by get_liked_post_ids
+LEGACY_BATCH_SIZE = 500
 
 
 def get_likes_key(name='default'):
     '''
-    define a parent group 'likes' identified by 'default'
-    useful for attaching data of all likes
+    define a parent group 'likes' identified by 'default',
+    the parent of legacy likes (see PostHelper.LEGACY_ENTITY_GROUPS)
+    '''
+    return ndb.Key('likes', name)
+
+
+def get_like_key(post_id, username):
+    '''
+    get key of the like of a post by a user, likes are stored under
+    their post
     '''
-    return db.Key.from_path('likes', name)
+    return ndb.Key('Like', str(username),
+                   parent=PostHelper.get_post_key(post_id))
+
+
+def get_legacy_like_key(post_id, username):
+    '''
+    get key of a like written before likes were stored under their post
+    '''
+    return ndb.Key('Like', '%s:%s' % (post_id, username),
+                   parent=get_likes_key())
+
+
+def get_like_keys(post_id, username):
+    '''
+    keys the like of a post by a user may be stored under
+    '''
+    keys = [get_like_key(post_id, username)]
+    if PostHelper.LEGACY_ENTITY_GROUPS:
+        keys.append(get_legacy_like_key(post_id, username))
+    return keys
+
+
+@ndb.tasklet
+def get_like_async(post_id, username):
+    '''
+    get like of a post by a user, asynchronously (returns a future)
+    '''
+    likes = yield ndb.get_multi_async(get_like_keys(post_id, username))
+    like = next((like for like in likes if like), None)
+    if not like and LEGACY_LIKE_LOOKUP:
+        like = yield get_postlikes_by_username(post_id, username).get_async()
+    raise ndb.Return(like)
+
+
+def get_like(post_id, username):
+    '''
+    get like of a post by a user, None if the user did not like the post
+    '''
+    return get_like_async(post_id, username).get_result()
 
 
 def get_like_by_id(like_id):
@@ -23,26 +86,171 @@ def get_postlikes_by_username(post_id, username):
     '''
     post_id = str(post_id)
     username = str(username)
-    likes = Like.all().filter('username = ', username).filter(
-        'post_id = ', post_id).ancestor(get_likes_key())
+    likes = Like.query(ancestor=get_likes_key()).filter(
+        Like.username == username, Like.post_id == post_id)
+    return likes
+
+
+def get_legacy_likes_by_username(username):
+    '''
+    get the likes with numeric ids of a user, of all posts
+    '''
+    return Like.query(ancestor=get_likes_key()).filter(
+        Like.username == str(username))
+
+
+def get_likes_for_post(post_id):
+    '''
+    get all likes of a post (stored under the post)
+    '''
+    return Like.query(ancestor=PostHelper.get_post_key(post_id))
+
+
+def get_legacy_likes_for_post(post_id):
+    '''
+    get the likes of a post written before likes were stored under
+    their post
+    '''
+    post_id = str(post_id)
+    likes = Like.query(ancestor=get_likes_key()).filter(
+        Like.post_id == post_id)
     return likes
 
 
+def count_likes_for_post(post_id):
+    '''
+    count Like entities of a post (slow, use get_likes_count_for_post)
+    '''
+    count = get_likes_for_post(post_id).count()
+    if PostHelper.LEGACY_ENTITY_GROUPS:
+        count += get_legacy_likes_for_post(post_id).count()
+    return count
+
+
 def get_likes_count_for_post(post_id):
     '''
-    get likes count for a post
+    get likes count for a post (from the sharded likes counter)
+    '''
+    return CounterHelper.get_likes_count(post_id)
+
+
+def add_like(post_id, username):
+    '''
+    put the like of a post by a user and increment the likes counter of the
+    post, atomically. liking a post twice does nothing.
     '''
     post_id = str(post_id)
-    likes = Like.all().filter(
-        'post_id = ', post_id).ancestor(get_likes_key())
-    return likes.count()
+
+    def txn():
+        like = get_like(post_id, username)
+        if like:
+            return like
+        like = Like(key=get_like_key(post_id, username),
+                    post_id=post_id,
+                    username=username, like=True)
+        like.put()
+        CounterHelper.increment_likes_count(post_id, 1)
+        return like
+
+    return ndb.transaction(txn, xg=True)
+
+
+def remove_like(post_id, username):
+    '''
+    delete the like of a post by a user and decrement the likes counter of
+    the post, atomically. unliking a post which is not liked does nothing.
+    '''
+    post_id = str(post_id)
+
+    def txn():
+        like = get_like(post_id, username)
+        if like:
+            like.key.delete()
+            CounterHelper.increment_likes_count(post_id, -1)
+
+    ndb.transaction(txn, xg=True)
 
 
 def like_exists(like_id):
     '''
     return like if it exists
     '''
-    key = db.Key.from_path('likes', int(like_id))
-    like = db.get(key)
+    key = ndb.Key('likes', int(like_id))
+    like = key.get()
     if like:
         return like
+
+
+def get_liked_post_ids(post_ids, username):
+    '''
+    return the subset of post_ids liked by username,
+    using a single batch get of the like keys (plus one query for the
+    likes of the user with numeric ids, run at the same time), so the
+    number of rpcs does not grow with the number of posts
+    '''
+    post_ids = [str(post_id) for post_id in post_ids]
+    keys = []
+    for post_id in post_ids:
+        keys.extend(get_like_keys(post_id, username))
+    # every post is an entity group, the datastore library would split the
+    # get into rpcs of 10 groups
+    likes_future = ndb.get_multi_async(
+        keys, max_entity_groups_per_rpc=len(post_ids) + 1)
+    if LEGACY_LIKE_LOOKUP:
+        legacy_future = get_legacy_likes_by_username(username).fetch_async(
+            batch_size=LEGACY_BATCH_SIZE)
+    else:
+        legacy_future = None
+
+    liked = set(like.post_id for like in
+                [future.get_result() for future in likes_future] if like)
+    if legacy_future:
+        liked.update(like.post_id for like in legacy_future.get_result()
+                     if like.post_id in post_ids)
+    return liked
+
+
+def get_likes_counts_for_posts(post_ids):
+    '''
+    get likes count for a list of posts, as a dict keyed by post id
+    '''
+    return CounterHelper.get_likes_counts(post_ids)
+
+
+def migrate_likes(cursor=None):
+    '''
+    job: rewrite likes with numeric ids as likes keyed by post id and
+    username, duplicate likes are dropped and the likes counters of the
+    affected posts are rebuilt. runs in batches, every batch defers the
+    next one. the likes stay in the legacy group, run
+    PostHelper.migrate_entity_groups afterwards
+    '''
+    query = Like.query(ancestor=get_likes_key())
+    likes, next_cursor, more = query.fetch_page(
+        JOB_BATCH_SIZE,
+        start_cursor=Cursor(urlsafe=cursor) if cursor else None)
+    legacy_likes = [like for like in likes if like.key.integer_id()]
+
+    def txn():
+        # all likes are in one entity group, migrate the batch at once
+        keyed = {}
+        for like in legacy_likes:
+            key = get_legacy_like_key(like.post_id, like.username)
+            keyed[key] = Like(key=key,
+                              post_id=like.post_id,
+                              username=like.username, like=True)
+        ndb.put_multi(keyed.values())
+        ndb.delete_multi([like.key for like in legacy_likes])
+
+    ndb.transaction(txn)
+
+    post_ids = set(like.post_id for like in legacy_likes)
+    for post_id in post_ids:
+        CounterHelper.rebuild_likes_count(post_id)
+
+    logging.info('migrate_likes: %d likes read, %d migrated, '
+                 '%d counters rebuilt',
+                 len(likes), len(legacy_likes), len(post_ids))
+
+    if more and next_cursor:
+        deferred.defer(migrate_likes, next_cursor.urlsafe())
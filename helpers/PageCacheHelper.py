@@ -0,0 +1,189 @@
+import functools
+import hashlib
+import time
+
+from google.appengine.api import memcache
+from google.appengine.ext import deferred
+import config
+import CompressionHelper
+import SessionHelper
+import TemplateHelper
+
+# memcache key of a content version, writes bump the versions of what
+# they change: a post's version (its page and comments pages), the list
+# version (front page, archive, search) or the version of all pages
+VERSION_KEY = 'pagecache:version:%s'
+ALL_PAGES = 'all'
+LIST_PAGES = 'lists'
+
+# seconds a rendered page lives in memcache
+PAGE_TTL = 10 * 60
+
+# seconds until queries over all posts see a write (they are not
+# ancestor queries, see PostHelper.get_posts_query)
+QUERY_DELAY = 5
+
+
+def get_post_scope(post_id):
+    return 'post:%d' % int(post_id)
+
+
+def get_versions(scopes):
+    '''
+    current content versions of scopes, part of the cached page keys,
+    fetched with one memcache get
+    '''
+    keys = [VERSION_KEY % scope for scope in scopes]
+    versions = memcache.get_multi(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        # start from the time, so a memcache flush never brings back
+        # a version that cached pages were stored under
+        memcache.add_multi(dict.fromkeys(missing, int(time.time())))
+        versions.update(memcache.get_multi(missing))
+    return [versions.get(key) for key in keys]
+
+
+def bump_version(scope):
+    if memcache.incr(VERSION_KEY % scope) is None:
+        memcache.add(VERSION_KEY % scope, int(time.time()))
+
+
+def invalidate():
+    '''
+    no cached page is served anymore, call this after writes which
+    change many posts (jobs)
+    '''
+    bump_version(ALL_PAGES)
+
+
+def invalidate_lists():
+    '''
+    cached front page, archive and search pages are not served anymore
+    '''
+    bump_version(LIST_PAGES)
+
+
+def invalidate_post(post_id, requery=False):
+    '''
+    cached pages showing a post (its page, its comments pages and the
+    lists) are not served anymore, call this after writing the post, its
+    comments or likes. with requery the lists are invalidated once more
+    after QUERY_DELAY seconds, call it so after writing the post itself:
+    lists rendered before the post queries see the write are not served
+    after that
+    '''
+    bump_version(get_post_scope(post_id))
+    invalidate_lists()
+    if requery:
+        deferred.defer(invalidate_lists, _countdown=QUERY_DELAY)
+
+
+def get_page_key(path_qs, versions):
+    '''
+    memcache key of a page (route with query string and content versions)
+    '''
+    return 'page:%s:%s' % ('.'.join(str(version) for version in versions),
+                           hashlib.sha1(path_qs).hexdigest())
+
+
+def is_cacheable(request):
+    '''
+    only anonymous get requests (no session cookie) are served from cache
+    '''
+    return (request.method == 'GET' and
+            not request.cookies.get(SessionHelper.SESSION_COOKIE) and
+            not request.cookies.get('user_id'))
+
+
+def store_page(key, body):
+    '''
+    store a rendered page, gzipped too if it is large enough
+    '''
+    page = dict(body=body, created=time.time())
+    if len(body) >= config.COMPRESS_MIN_BYTES:
+        page['gzip_body'] = CompressionHelper.compress(body, 'page cache')
+    memcache.set(key, page, time=PAGE_TTL)
+
+
+class CachingStream(object):
+
+    '''
+    response app_iter of a streamed page missing from the cache: chunks
+    are sent as they are rendered and the page is stored after the last
+    one, an interrupted stream is not stored
+    '''
+
+    def __init__(self, chunks, key):
+        self.chunks = chunks
+        self.key = key
+
+    def __iter__(self):
+        body = []
+        for chunk in self.chunks:
+            body.append(chunk)
+            yield chunk
+        store_page(self.key, ''.join(body))
+
+
+def cache_pages(get, get_scopes):
+    '''
+    wrap handler get method get: anonymous requests are served from the
+    page cache, pages are keyed by the versions of the scopes
+    get_scopes(*args) returns. X-Page-Cache tells HIT or MISS and Age the
+    age of the page in seconds. pages are stored gzipped too, so clients
+    accepting gzip get the stored variant without compressing it again
+    '''
+
+    @functools.wraps(get)
+    def cached_get(handler, *args, **kwargs):
+        if not is_cacheable(handler.request):
+            return get(handler, *args, **kwargs)
+
+        versions = get_versions([ALL_PAGES] + get_scopes(*args))
+        key = get_page_key(handler.request.path_qs, versions)
+        page = memcache.get(key)
+
+        if page:
+            handler.response.headers['X-Page-Cache'] = 'HIT'
+            handler.response.headers['Age'] = str(
+                int(time.time() - page['created']))
+            handler.response.headers['Vary'] = 'Accept-Encoding'
+            if page.get('gzip_body') and CompressionHelper.accepts_gzip(
+                    handler.request.headers.get('Accept-Encoding')):
+                handler.response.headers['Content-Encoding'] = 'gzip'
+                handler.response.write(page['gzip_body'])
+            else:
+                handler.response.write(page['body'])
+            return
+
+        get(handler, *args, **kwargs)
+        handler.response.headers['X-Page-Cache'] = 'MISS'
+        handler.response.headers['Age'] = '0'
+
+        response = handler.response
+        if response.status_int != 200 or 'Set-Cookie' in response.headers:
+            return
+        if isinstance(response.app_iter, TemplateHelper.Stream):
+            # reading the body would render the whole page before its
+            # first byte is sent
+            response.app_iter = CachingStream(response.app_iter, key)
+        else:
+            store_page(key, response.body)
+
+    return cached_get
+
+
+def cached_page(get):
+    '''
+    decorator for get methods of list pages (front page, archive, search)
+    '''
+    return cache_pages(get, lambda *args: [LIST_PAGES])
+
+
+def cached_post_page(get):
+    '''
+    decorator for get methods of pages of one post, the post id is the
+    first argument
+    '''
+    return cache_pages(get, lambda post_id, *args: [get_post_scope(post_id)])
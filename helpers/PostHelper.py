@@ -1,81 +1,715 @@
-from google.appengine.ext import db
-from models import Post
+import cgi
+import datetime
+import logging
 import os
-import jinja2
+import time
+
+from google.appengine.api import memcache
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import deferred
+from google.appengine.ext import ndb
+from models import Comment
+from models import Like
+from models import LikeCounterShard
+from models import Post
 import BlogHelper
+import CacheHelper
+import CounterHelper
 import LikeHelper
+import PageCacheHelper
 import CommentHelper
+import TemplateHelper
+
+# posts per page on the front page and in the archive
+PAGE_SIZE = 10
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# seconds a rendered post fragment lives in memcache
+FRAGMENT_TTL = 24 * 60 * 60
+
+# marks the place of the viewer specific like link in a post fragment
+LIKE_LINK_PLACEHOLDER = '<!--like-link-->'
 
-# build path to templates directory
-template_dir = os.path.join(os.path.dirname(__file__), "../templates")
-# initialize jinja environment
-jinja_env = jinja2.Environment(
-    loader=jinja2.FileSystemLoader(template_dir), autoescape=True)
+# posts processed per task by the backfill job
+JOB_BATCH_SIZE = 50
+
+# comments or likes deleted per task by the cascade delete and sweeper jobs
+DELETE_BATCH_SIZE = 500
+
+# posts are root entities and their comments and likes are stored under
+# them, posts, comments and likes written before that are in one entity
+# group per kind (get_posts_key, CommentHelper.get_comments_key,
+# LikeHelper.get_likes_key) and are read from there too, until
+# migrate_entity_groups has moved them. set to False once it is done.
+LEGACY_ENTITY_GROUPS = True
+
+# comments or likes moved per transaction by the migration job
+MIGRATE_BATCH_SIZE = 100
+
+# render_post(s) start their fetches at once, False waits for every fetch
+# before starting the next (compared by tools/bench_suite.py)
+CONCURRENT_FETCHES = True
 
 
 def render_post_str(template, **params):
-    t = jinja_env.get_template(template)
-    return t.render(params)
+    return TemplateHelper.render_str(template, **params)
 
 
 def get_posts_key(name='default'):
     '''
-    define a parent group 'posts' identified by 'default'
-    useful for attaching data of all posts
+    define a parent group 'posts' identified by 'default',
+    the parent of legacy posts. ids of new posts are allocated from it,
+    so they never clash with the ids of legacy posts
+    '''
+    return ndb.Key('posts', name)
+
+
+def get_post_key(post_id):
+    '''
+    get post key by post id, posts are root entities
     '''
-    return db.Key.from_path('posts', name)
+    return ndb.Key('Post', int(post_id))
+
+
+def get_legacy_post_key(post_id):
+    '''
+    get key of a post written before posts were root entities
+    '''
+    return ndb.Key('Post', int(post_id), parent=get_posts_key())
+
+
+def get_post_keys(post_id):
+    '''
+    keys a post may be stored under
+    '''
+    keys = [get_post_key(post_id)]
+    if LEGACY_ENTITY_GROUPS:
+        keys.append(get_legacy_post_key(post_id))
+    return keys
+
+
+def allocate_post_key():
+    '''
+    key of a new post
+    '''
+    post_id, _ = Post.allocate_ids(1, parent=get_posts_key())
+    return get_post_key(post_id)
+
+
+def get_posts_query():
+    '''
+    query of all posts. it is not an ancestor query, so it is eventually
+    consistent: a write can take a moment to show up in its results
+    (see PageCacheHelper.invalidate_post)
+    '''
+    return Post.query()
+
+
+@ndb.tasklet
+def get_post_by_id_async(post_id):
+    '''
+    get post object by post id (cached, see CacheHelper),
+    asynchronously (returns a future)
+    '''
+    post = yield CacheHelper.get_async(get_post_key(post_id))
+    if not post and LEGACY_ENTITY_GROUPS:
+        post = yield CacheHelper.get_async(get_legacy_post_key(post_id))
+    raise ndb.Return(post)
 
 
 def get_post_by_id(post_id):
     '''
-    get post object by post id
+    get post object by post id (cached, see CacheHelper)
+    '''
+    return get_post_by_id_async(post_id).get_result()
+
+
+def get_posts_by_ids(post_ids):
+    '''
+    get posts by post ids with one batch get, None for missing posts
+    '''
+    keys = [get_post_keys(post_id) for post_id in post_ids]
+    found = ndb.get_multi([key for post_keys in keys for key in post_keys])
+    posts = []
+    for post_keys in keys:
+        candidates, found = found[:len(post_keys)], found[len(post_keys):]
+        posts.append(next((post for post in candidates if post), None))
+    return posts
+
+
+def invalidate_post(post_id):
+    '''
+    remove post from the cache, call this after writing the post
+    '''
+    CacheHelper.invalidate(*get_post_keys(post_id))
+
+
+def normalize_content(content):
+    '''
+    source text of a post: newlines only
+    '''
+    return content.replace('\r\n', '\n')
+
+
+def normalize_legacy_content(content):
+    '''
+    source text of a post written before content_html was added, posts
+    edited back then store <br> for newlines
+    '''
+    return normalize_content(content).replace('<br>', '\n')
+
+
+def get_post_source(post):
+    '''
+    source text of a post, also of posts written before content_html was
+    added
+    '''
+    if post.content_html is None:
+        return normalize_legacy_content(post.content)
+    return post.content
+
+
+def render_content_html(content):
+    '''
+    render post source text to html: escaped, newlines to <br>
+    '''
+    return cgi.escape(content, quote=True).replace('\n', '<br>')
+
+
+def set_post_content(post, content):
+    '''
+    set post source text and its html, call this on every content write
+    '''
+    post.content = normalize_content(content)
+    post.content_html = render_content_html(post.content)
+
+
+def edit_post(post_key, subject, content):
+    '''
+    set subject and content of a post, the post is read again inside the
+    transaction so the comments data kept up to date by CommentHelper is
+    not overwritten with a cached copy. returns the post, None if it is gone
+    '''
+
+    def txn():
+        post = post_key.get()
+        if post:
+            post.subject = subject
+            set_post_content(post, content)
+            post.put()
+        return post
+
+    post = ndb.transaction(txn)
+    invalidate_post(post_key.id())
+    return post
+
+
+def fill_content_html(post):
+    '''
+    set source text and content_html of posts written before
+    content_html was added (not stored), until backfill_post_html has run
+    '''
+    if post.content_html is None:
+        set_post_content(post, normalize_legacy_content(post.content))
+
+
+def backfill_post_html(cursor=None):
+    '''
+    job: set source text and content_html of posts written before
+    content_html was added, runs in batches, every batch defers the next one
+    '''
+    query = get_posts_query()
+    post_keys, next_cursor, more = query.fetch_page(
+        JOB_BATCH_SIZE, keys_only=True,
+        start_cursor=Cursor(urlsafe=cursor) if cursor else None)
+
+    def txn(post_key):
+        post = post_key.get()
+        if post and post.content_html is None:
+            set_post_content(post, normalize_legacy_content(post.content))
+            post.put()
+            return post
+
+    # every post is its own entity group, update them one by one
+    posts = []
+    for post_key in post_keys:
+        post = ndb.transaction(lambda: txn(post_key))
+        if post:
+            posts.append(post)
+    for post in posts:
+        invalidate_post(post.key.id())
+    if posts:
+        PageCacheHelper.invalidate()
+
+    logging.info('backfill_post_html: %d posts read, %d rendered',
+                 len(post_keys), len(posts))
+
+    if more and next_cursor:
+        deferred.defer(backfill_post_html, next_cursor.urlsafe())
+
+
+def delete_post(post_id):
+    '''
+    delete a post, its comments, likes and likes counter are deleted in
+    the background (delete_post_dependents)
+    '''
+    post_id = str(post_id)
+
+    def txn():
+        ndb.delete_multi(get_post_keys(post_id))
+        # enqueued only if the post is deleted
+        deferred.defer(delete_post_dependents, post_id, _transactional=True)
+
+    ndb.transaction(txn, xg=True)
+    invalidate_post(post_id)
+
+
+def get_dependents_queries(post_id):
+    '''
+    keys only queries of the comments and likes of a post
+    '''
+    queries = [CommentHelper.get_comments_for_post(post_id),
+               LikeHelper.get_likes_for_post(post_id)]
+    if LEGACY_ENTITY_GROUPS:
+        queries.extend([CommentHelper.get_legacy_comments_for_post(post_id),
+                        LikeHelper.get_legacy_likes_for_post(post_id)])
+    return queries
+
+
+def delete_post_dependents(post_id):
+    '''
+    job: delete comments, likes and the likes counter of a deleted post,
+    DELETE_BATCH_SIZE entities per task, every task defers the next one.
+    every task starts the queries over (deleted entities are gone), so a
+    failed or repeated task just carries on
+    '''
+    post_id = str(post_id)
+    for query in get_dependents_queries(post_id):
+        keys = query.fetch(DELETE_BATCH_SIZE, keys_only=True)
+        if keys:
+            ndb.delete_multi(keys)
+            CacheHelper.invalidate(*keys)
+            logging.info('delete_post_dependents %s: deleted %d %s',
+                         post_id, len(keys), keys[0].kind())
+            deferred.defer(delete_post_dependents, post_id)
+            return
+
+    ndb.delete_multi(CounterHelper.get_shard_keys(post_id))
+    logging.info('delete_post_dependents %s: done', post_id)
+
+
+def sweep_orphans(kind='Comment', cursor=None):
+    '''
+    job: delete comments, likes and likes counter shards of posts which
+    do not exist anymore (left behind by deletes before
+    delete_post_dependents). runs in batches, every batch defers the next
+    one, then the next kind
+    '''
+    kinds = ['Comment', 'Like', 'LikeCounterShard']
+    queries = dict(
+        Comment=Comment.query(),
+        Like=Like.query(),
+        LikeCounterShard=LikeCounterShard.query())
+    query = queries[kind]
+
+    entities, next_cursor, more = query.fetch_page(
+        DELETE_BATCH_SIZE,
+        start_cursor=Cursor(urlsafe=cursor) if cursor else None)
+
+    post_ids = sorted(set(entity.post_id for entity in entities))
+    posts = get_posts_by_ids(post_ids)
+    missing = set(post_id for post_id, post in zip(post_ids, posts)
+                  if not post)
+    orphans = [entity.key for entity in entities
+               if entity.post_id in missing]
+    ndb.delete_multi(orphans)
+    CacheHelper.invalidate(*orphans)
+
+    logging.info('sweep_orphans: %d %s read, %d orphans deleted',
+                 len(entities), kind, len(orphans))
+
+    if more and next_cursor:
+        deferred.defer(sweep_orphans, kind, next_cursor.urlsafe())
+    elif kinds.index(kind) + 1 < len(kinds):
+        deferred.defer(sweep_orphans, kinds[kinds.index(kind) + 1])
+
+
+def move_entities(query, make_key):
+    '''
+    move a batch of entities of an ancestor query to the keys make_key
+    returns for them, in one transaction (entities getting the same key
+    are merged). returns the number of entities moved
+    '''
+
+    def txn():
+        entities = query.fetch(MIGRATE_BATCH_SIZE)
+        moved = dict((make_key(entity), entity) for entity in entities)
+        ndb.put_multi([type(entity)(key=key, **entity.to_dict())
+                       for key, entity in moved.items()])
+        ndb.delete_multi([entity.key for entity in entities])
+        return [entity.key for entity in entities] + moved.keys()
+
+    keys = ndb.transaction(txn, xg=True)
+    CacheHelper.invalidate(*keys)
+    return len(keys)
+
+
+def migrate_post_entity_group(post_id):
+    '''
+    move the legacy comments and likes of a post under the post, then
+    the post itself to its root key. every batch is moved in a
+    transaction, readers find an entity at either its old or its new key
     '''
-    return Post.get_by_id(int(post_id), parent=get_posts_key())
+    post_id = str(post_id)
+    moves = [
+        (CommentHelper.get_legacy_comments_for_post(post_id),
+         lambda comment: CommentHelper.get_comment_key(comment.key.id(),
+                                                       post_id)),
+        (LikeHelper.get_legacy_likes_for_post(post_id),
+         lambda like: LikeHelper.get_like_key(post_id, like.username)),
+    ]
+    for query, make_key in moves:
+        while move_entities(query, make_key):
+            pass
 
+    def txn():
+        post = get_legacy_post_key(post_id).get()
+        if post:
+            # last_modified is set to the time of the move
+            Post(key=get_post_key(post_id), **post.to_dict()).put()
+            post.key.delete()
 
-def render_post(post_id, session_user=False, show_comments=False):
+    ndb.transaction(txn, xg=True)
+    invalidate_post(post_id)
+
+
+def migrate_entity_groups(cursor=None):
     '''
-    render blog post (html string) using post id
+    job: move legacy posts to their root keys and their comments and
+    likes under them (see LEGACY_ENTITY_GROUPS), runs in batches, every
+    batch defers the next one
     '''
+    query = Post.query(ancestor=get_posts_key())
+    post_keys, next_cursor, more = query.fetch_page(
+        JOB_BATCH_SIZE, keys_only=True,
+        start_cursor=Cursor(urlsafe=cursor) if cursor else None)
 
-    # get post
-    post = get_post_by_id(post_id)
+    for post_key in post_keys:
+        migrate_post_entity_group(post_key.id())
+    if post_keys:
+        PageCacheHelper.invalidate()
 
-    if post:
+    logging.info('migrate_entity_groups: moved %d posts', len(post_keys))
 
-        if session_user:
-            # get likes by post id and username
-            likes = LikeHelper.get_postlikes_by_username(
-                post_id, session_user.username)
+    if more and next_cursor:
+        deferred.defer(migrate_entity_groups, next_cursor.urlsafe())
 
-            # get latest like id (in case post got liked by the same user
-            # multiple times)
-            if likes.count():
-                like_id = likes[0].key().id()
-            else:
-                like_id = 0
-        else:
-            like_id = 0
 
-        # get comments for post
-        comments = CommentHelper.get_comments_for_post(post_id)
+def to_microseconds(time):
+    '''
+    datetime to microseconds since the epoch
+    '''
+    delta = time - EPOCH
+    return ((delta.days * 24 * 60 * 60 + delta.seconds) * 1000000 +
+            delta.microseconds)
 
-        # get likes count for post
-        likes_count = LikeHelper.get_likes_count_for_post(post_id)
 
-        # replace newlines with <br>
-        post._render_text = post.content.replace('\n', '<br>')
+def make_page_cursor(direction, created):
+    '''
+    build a page cursor: direction ('next' = older posts, 'prev' = newer
+    posts) and the created time of the last post seen, in microseconds
+    '''
+    return '%s-%d' % (direction, to_microseconds(created))
+
+
+def parse_page_cursor(cursor):
+    '''
+    return (direction, created) of a page cursor, (None, None) if the
+    cursor is empty or invalid
+    '''
+    try:
+        direction, microseconds = str(cursor).split('-')
+        created = EPOCH + datetime.timedelta(microseconds=int(microseconds))
+    except (ValueError, OverflowError, UnicodeError):
+        return None, None
+    if direction not in ('next', 'prev'):
+        return None, None
+    return direction, created
+
+
+def get_posts_page(cursor=None, start=None, end=None, page_size=PAGE_SIZE):
+    '''
+    get a page of posts, newest first, optionally only posts created in
+    [start, end). pages are keyed by the created time of the posts
+    around them, so every page costs one query no matter how deep it is.
+    returns (posts, newer page cursor, older page cursor),
+    cursors are None if there is no such page
+    note: posts created in the very same microsecond may be skipped
+    '''
+    direction, boundary = parse_page_cursor(cursor)
+
+    query = get_posts_query()
+    if start:
+        query = query.filter(Post.created >= start)
+    if end:
+        query = query.filter(Post.created < end)
+
+    if direction == 'prev':
+        query = query.filter(Post.created > boundary).order(Post.created)
+    else:
+        if direction == 'next':
+            query = query.filter(Post.created < boundary)
+        query = query.order(-Post.created)
+
+    # fetch one extra post to know whether there is one more page
+    posts = query.fetch(page_size + 1)
+    has_more = len(posts) > page_size
+    posts = posts[:page_size]
+
+    if direction == 'prev':
+        posts.reverse()
+        has_newer, has_older = has_more, True
+    else:
+        has_newer, has_older = direction == 'next', has_more
+
+    newer_cursor = older_cursor = None
+    if posts and has_newer:
+        newer_cursor = make_page_cursor('prev', posts[0].created)
+    if posts and has_older:
+        older_cursor = make_page_cursor('next', posts[-1].created)
+    return posts, newer_cursor, older_cursor
+
+
+def get_archive_months():
+    '''
+    list of (year, month) tuples from the newest post to the oldest one
+    '''
+    query = get_posts_query()
+    newest_future = query.order(-Post.created).get_async()
+    oldest_future = query.order(Post.created).get_async()
+    newest, oldest = newest_future.get_result(), oldest_future.get_result()
+    if not newest:
+        return []
+
+    months = []
+    year, month = newest.created.year, newest.created.month
+    while (year, month) >= (oldest.created.year, oldest.created.month):
+        months.append((year, month))
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return months
+
+
+def get_month_range(year, month):
+    '''
+    return (start, end) datetimes of a month
+    '''
+    start = datetime.datetime(year, month, 1)
+    if month == 12:
+        end = datetime.datetime(year + 1, 1, 1)
+    else:
+        end = datetime.datetime(year, month + 1, 1)
+    return start, end
+
+
+def get_fragment_key(post, likes_count, show_comments):
+    '''
+    memcache key of a rendered post fragment, it changes whenever
+    anything shown in the fragment changes (and on every deploy)
+    '''
+    return 'post-fragment:%s:%d:%d:%d:%d:%d' % (
+        os.environ.get('CURRENT_VERSION_ID', ''),
+        post.key.id(),
+        to_microseconds(post.last_modified),
+        likes_count,
+        post.comment_version or 0,
+        bool(show_comments))
+
+
+def generate_post_fragments(posts, likes_counts, show_comments=False):
+    '''
+    render the viewer independent part of posts (generator of html
+    strings), the like link is left as a placeholder. fragments are
+    cached in memcache, cached fragments of all posts are fetched with
+    one get, missing ones are rendered as they are reached
+    '''
+    keys = [get_fragment_key(post, likes_counts[str(post.key.id())],
+                             show_comments)
+            for post in posts]
+    fragments = memcache.get_multi(keys)
+
+    rendered = {}
+    for post, key in zip(posts, keys):
+        if key not in fragments:
+            fill_content_html(post)
+            rendered[key] = fragments[key] = render_post_str(
+                "post.html",
+                p=post,
+                like_link=LIKE_LINK_PLACEHOLDER,
+                likes_count=likes_counts[str(post.key.id())],
+                show_comments=show_comments,
+                comments=None
+            )
+        yield fragments[key]
+    if rendered:
+        memcache.set_multi(rendered, time=FRAGMENT_TTL)
+
+
+def render_post_fragments(posts, likes_counts, show_comments=False):
+    '''
+    render the viewer independent part of posts (list of html strings),
+    see generate_post_fragments
+    '''
+    return list(generate_post_fragments(posts, likes_counts, show_comments))
+
+
+def render_like_link(post, liked):
+    '''
+    render the viewer specific like/unlike link of a post
+    '''
+    return render_post_str(
+        "likelink.html", post_id=post.key.id(), liked=liked)
+
+
+def render_post_entity(post, liked=False, likes_count=0,
+                       show_comments=False, comments=None,
+                       comments_cursor=None):
+    '''
+    render an already fetched post entity (html string),
+    from the fragment cache unless a page of comments is passed
+    (comments_cursor is the cursor of the next page)
+    '''
+    like_link = render_like_link(post, liked)
+
+    if comments is not None:
+        fill_content_html(post)
 
         # render html string
         return render_post_str(
             "post.html",
             p=post,
-            like_id=like_id,
+            like_link=like_link,
             likes_count=likes_count,
             show_comments=show_comments,
-            comments=comments
+            comments=comments,
+            comments_cursor=comments_cursor,
+            post_id=post.key.id()
         )
+
+    fragment = render_post_fragments(
+        [post], {str(post.key.id()): likes_count}, show_comments)[0]
+    return fragment.replace(LIKE_LINK_PLACEHOLDER, like_link, 1)
+
+
+def start_fetch(future):
+    '''
+    future of a fetch, waited for at once unless CONCURRENT_FETCHES
+    '''
+    if not CONCURRENT_FETCHES:
+        future.wait()
+    return future
+
+
+@ndb.tasklet
+def render_post_async(post_id, session_user=False, show_comments=False,
+                      all_comments=False, comments_cursor=None):
+    '''
+    start every fetch render_post needs at once (post, like of the session
+    user, likes counter, comments), returns a future of the html string
+    '''
+
+    # get post (from the cache)
+    post_future = start_fetch(get_post_by_id_async(post_id))
+
+    # has the session user liked the post?
+    if session_user:
+        like_future = start_fetch(LikeHelper.get_like_async(
+            post_id, session_user.username))
+    else:
+        like_future = None
+
+    # get likes count for post
+    likes_count_future = start_fetch(
+        CounterHelper.get_likes_counts_async([post_id]))
+
+    # get a page of comments for post
+    if show_comments and all_comments:
+        comments_future = start_fetch(CommentHelper.get_comments_page_async(
+            post_id, comments_cursor))
     else:
+        comments_future = None
+
+    post = yield post_future
+    if not post:
         # already being checked in controller
         # this is for safety!
-        return "Post Not Found!"
+        raise ndb.Return("Post Not Found!")
+
+    like = (yield like_future) if like_future else None
+    likes_counts = yield likes_count_future
+    comments, next_cursor = (
+        (yield comments_future) if comments_future else (None, None))
+
+    raise ndb.Return(render_post_entity(
+        post,
+        liked=bool(like),
+        likes_count=likes_counts[str(post_id)],
+        show_comments=show_comments,
+        comments=comments,
+        comments_cursor=next_cursor
+    ))
+
+
+def render_post(post_id, session_user=False, show_comments=False,
+                all_comments=False, comments_cursor=None):
+    '''
+    render blog post (html string) using post id,
+    with show_comments the latest comments stored on the post are shown,
+    a page of all comments (from comments_cursor) is queried only if
+    all_comments is set too
+    '''
+    started = time.time()
+    html = render_post_async(
+        post_id, session_user, show_comments, all_comments,
+        comments_cursor).get_result()
+    logging.debug('render_post %s: %.1f ms', post_id,
+                  (time.time() - started) * 1000)
+    return html
+
+
+def render_posts(posts, session_user=False):
+    '''
+    render a list of already fetched posts (list of html strings),
+    likes data for all posts is fetched in one go instead of per post
+    '''
+    return list(generate_posts(posts, session_user))
+
+
+def generate_posts(posts, session_user=False):
+    '''
+    render already fetched posts lazily (generator of html strings):
+    nothing is fetched or rendered before the first post is asked for,
+    so a streamed page sends its header first (config.STREAM_TEMPLATES)
+    '''
+    posts = list(posts)
+    post_ids = [str(p.key.id()) for p in posts]
+
+    # likes count of every post, fetched while the likes are looked up
+    likes_counts_future = start_fetch(
+        CounterHelper.get_likes_counts_async(post_ids))
+
+    # posts liked by the session user
+    if session_user:
+        liked_ids = LikeHelper.get_liked_post_ids(
+            post_ids, session_user.username)
+    else:
+        liked_ids = set()
+
+    likes_counts = likes_counts_future.get_result()
+
+    # viewer independent part of every post, from the fragment cache
+    fragments = generate_post_fragments(posts, likes_counts)
+
+    for post, post_id, fragment in zip(posts, post_ids, fragments):
+        like_link = render_like_link(post, post_id in liked_ids)
+        yield fragment.replace(LIKE_LINK_PLACEHOLDER, like_link, 1)
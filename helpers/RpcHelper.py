@@ -0,0 +1,51 @@
+import threading
+
+from google.appengine.api import apiproxy_stub_map
+
+# counters are kept per thread, app.yaml runs us with threadsafe: true
+_local = threading.local()
+
+
+def _active_counters():
+    '''
+    return the list of counters active on the current thread
+    '''
+    if not hasattr(_local, 'counters'):
+        _local.counters = []
+    return _local.counters
+
+
+def _count_rpc(service, call, request, response):
+    '''
+    apiproxy pre call hook, counts the rpc on every active counter
+    '''
+    for counter in _active_counters():
+        counter.count += 1
+        counter.calls.append('%s.%s' % (service, call))
+
+
+class RpcCounter(object):
+
+    '''
+    count datastore rpcs made inside a with block
+
+    with RpcHelper.RpcCounter() as rpcs:
+        ...
+    rpcs.count, rpcs.calls
+    '''
+
+    def __init__(self):
+        self.count = 0
+        self.calls = []
+
+    def __enter__(self):
+        _active_counters().append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _active_counters().remove(self)
+        return False
+
+
+apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+    'rpc_counter', _count_rpc, 'datastore_v3')
@@ -0,0 +1,301 @@
+import logging
+import math
+import re
+
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import deferred
+from google.appengine.ext import ndb
+from models.SearchPosting import SearchPosting
+from models.SearchTerm import SearchTerm
+import PostHelper
+
+# words of at least MIN_TERM_LENGTH letters or digits are indexed
+TERM_RE = re.compile(r'\w+', re.UNICODE)
+MIN_TERM_LENGTH = 2
+MAX_TERM_LENGTH = 40
+
+STOP_WORDS = frozenset([
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'for', 'if',
+    'in', 'into', 'is', 'it', 'no', 'not', 'of', 'on', 'or', 'so', 'such',
+    'that', 'the', 'their', 'then', 'there', 'these', 'they', 'this', 'to',
+    'was', 'will', 'with'])
+
+# a term in the subject counts as much as SUBJECT_WEIGHT terms in the body
+SUBJECT_WEIGHT = 3
+
+# terms of a query used, candidate postings read per term
+MAX_QUERY_TERMS = 5
+MAX_POSTINGS = 200
+
+# results per search
+RESULTS = 10
+
+# posts indexed per task by the rebuild job
+JOB_BATCH_SIZE = 50
+
+# postings read per task by the sweep job
+SWEEP_BATCH_SIZE = 500
+
+
+def tokenize(text):
+    '''
+    list of search terms in text: lowercase words, no stop words
+    '''
+    return [term for term in TERM_RE.findall(text.lower())
+            if MIN_TERM_LENGTH <= len(term) <= MAX_TERM_LENGTH and
+            term not in STOP_WORDS]
+
+
+def get_term_scores(subject, content):
+    '''
+    {term: score} of a post, the score is the weighted term frequency
+    normalized by the length of the post
+    '''
+    weights = {}
+    for term in tokenize(subject):
+        weights[term] = weights.get(term, 0) + SUBJECT_WEIGHT
+    content_terms = tokenize(content)
+    for term in content_terms:
+        weights[term] = weights.get(term, 0) + 1
+
+    length = math.sqrt(len(weights) + len(content_terms) + 1)
+    return dict((term, weight / length) for term, weight in weights.items())
+
+
+def get_posting_key(term, post_id):
+    return ndb.Key('SearchPosting', '%s:%s' % (term, post_id))
+
+
+def get_posting_term(posting_key):
+    '''
+    term of a posting key (terms contain no colon)
+    '''
+    return posting_key.id().rsplit(':', 1)[0]
+
+
+def get_term_key(term):
+    return ndb.Key('SearchTerm', term)
+
+
+def get_postings_for_post(post_id):
+    '''
+    query the postings of a post (all its terms)
+    '''
+    return SearchPosting.query(SearchPosting.post_id == str(post_id))
+
+
+@ndb.transactional_tasklet
+def add_to_term_count(term, delta):
+    key = get_term_key(term)
+    search_term = yield key.get_async()
+    if not search_term:
+        search_term = SearchTerm(key=key)
+    search_term.count += delta
+    if search_term.count > 0:
+        yield search_term.put_async()
+    else:
+        yield key.delete_async()
+
+
+def update_term_counts(deltas):
+    '''
+    add {term: delta} to the post counts of the terms, every term is its
+    own entity group, the transactions run at once
+    '''
+    futures = [add_to_term_count(term, delta)
+               for term, delta in deltas.items() if delta]
+    for future in futures:
+        future.get_result()
+
+
+def index_posts(posts):
+    '''
+    write the postings of posts, replacing their old postings, and update
+    the post counts of the terms added or dropped, call this after putting
+    posts
+    '''
+    # old postings are found while the new ones are built
+    old_keys_futures = [get_postings_for_post(post.key.id()).fetch_async(
+        keys_only=True) for post in posts]
+
+    postings = []
+    for post in posts:
+        post_id = str(post.key.id())
+        scores = get_term_scores(post.subject,
+                                 PostHelper.get_post_source(post))
+        postings.extend(SearchPosting(key=get_posting_key(term, post_id),
+                                      term=term, post_id=post_id,
+                                      score=score)
+                        for term, score in scores.items())
+    # read before the put, so the new postings are not counted as old
+    old_keys = set(key for future in old_keys_futures
+                   for key in future.get_result())
+    ndb.put_multi(postings)
+
+    new_keys = set(posting.key for posting in postings)
+    stale_keys = old_keys - new_keys
+    ndb.delete_multi(list(stale_keys))
+
+    deltas = {}
+    for key in new_keys - old_keys:
+        term = get_posting_term(key)
+        deltas[term] = deltas.get(term, 0) + 1
+    for key in stale_keys:
+        term = get_posting_term(key)
+        deltas[term] = deltas.get(term, 0) - 1
+    update_term_counts(deltas)
+
+
+def index_post(post):
+    '''
+    write the postings of a post, call this after putting the post
+    '''
+    index_posts([post])
+
+
+def unindex_post(post_id):
+    '''
+    delete the postings of a post, call this after deleting the post
+    '''
+    keys = get_postings_for_post(post_id).fetch(keys_only=True)
+    ndb.delete_multi(keys)
+    update_term_counts(dict((get_posting_term(key), -1) for key in keys))
+
+
+def search(query, limit=RESULTS):
+    '''
+    ids of the posts best matching query, best first. a post scores the
+    sum of its term scores, rare terms weigh more than common ones.
+    candidates are the best postings of the rarest term (and of the next
+    rarest ones while there are fewer than limit), their postings of all
+    terms are then fetched by key, so matches and scores are exact
+    '''
+    terms = []
+    for term in tokenize(query):
+        if term not in terms:
+            terms.append(term)
+    terms = terms[:MAX_QUERY_TERMS]
+
+    # number of posts containing every term, with one batch get
+    search_terms = ndb.get_multi([get_term_key(term) for term in terms])
+    counts = dict((term, search_term.count if search_term else 0)
+                  for term, search_term in zip(terms, search_terms))
+    terms = sorted([term for term in terms if counts[term]],
+                   key=lambda term: counts[term])
+
+    candidates = []
+    for term in terms:
+        postings = SearchPosting.query(SearchPosting.term == term).order(
+            -SearchPosting.score).fetch(MAX_POSTINGS)
+        candidates.extend(posting.post_id for posting in postings
+                          if posting.post_id not in candidates)
+        if len(candidates) >= limit:
+            break
+
+    # postings of all terms of all candidates, with one batch get
+    keys = [get_posting_key(term, post_id)
+            for post_id in candidates for term in terms]
+    scores = {}
+    matches = {}
+    for posting in ndb.get_multi(keys):
+        if posting:
+            idf = 1.0 / math.log(2 + counts[posting.term])
+            scores[posting.post_id] = (scores.get(posting.post_id, 0) +
+                                       posting.score * idf)
+            matches[posting.post_id] = matches.get(posting.post_id, 0) + 1
+
+    # posts matching more terms first, then by score
+    ranked = sorted(scores, key=lambda post_id: (-matches[post_id],
+                                                 -scores[post_id]))
+    return ranked[:limit]
+
+
+def get_search_results(query, limit=RESULTS):
+    '''
+    posts best matching query, best first
+    '''
+    post_ids = search(query, limit)
+    posts = PostHelper.get_posts_by_ids(post_ids)
+    # postings of deleted posts may be left until the next rebuild
+    return [post for post in posts if post]
+
+
+def rebuild_search_index(cursor=None):
+    '''
+    job: index all posts again, the postings are overwritten in place, so
+    search keeps working while the job runs. runs in batches, every batch
+    defers the next one, then sweep_search_index
+    '''
+    query = PostHelper.get_posts_query()
+    posts, next_cursor, more = query.fetch_page(
+        JOB_BATCH_SIZE,
+        start_cursor=Cursor(urlsafe=cursor) if cursor else None)
+    index_posts(posts)
+
+    logging.info('rebuild_search_index: indexed %d posts', len(posts))
+
+    if more and next_cursor:
+        deferred.defer(rebuild_search_index, next_cursor.urlsafe())
+    else:
+        deferred.defer(sweep_search_index)
+
+
+def sweep_search_index(cursor=None, term=None, count=0, counted=None):
+    '''
+    job: delete postings of posts which do not exist anymore and count
+    the posts of every term again. postings are read ordered by term, term
+    and count carry the last term of a batch over to the next one, counted
+    is the last term whose count was written. runs in batches, every batch
+    defers the next one
+    '''
+    query = SearchPosting.query().order(SearchPosting.term,
+                                        SearchPosting.key)
+    postings, next_cursor, more = query.fetch_page(
+        SWEEP_BATCH_SIZE,
+        start_cursor=Cursor(urlsafe=cursor) if cursor else None)
+    done = not (more and next_cursor)
+
+    post_ids = sorted(set(posting.post_id for posting in postings))
+    posts = PostHelper.get_posts_by_ids(post_ids)
+    missing = set(post_id for post_id, post in zip(post_ids, posts)
+                  if not post)
+    orphans = [posting.key for posting in postings
+               if posting.post_id in missing]
+    ndb.delete_multi(orphans)
+
+    # counts of the terms completed in this batch
+    counts = {}
+    for posting in postings:
+        if posting.post_id in missing:
+            continue
+        if posting.term != term:
+            if term is not None:
+                counts[term] = count
+            term, count = posting.term, 0
+        count += 1
+    if done and term is not None:
+        counts[term] = count
+
+    ndb.put_multi([SearchTerm(key=get_term_key(t), count=c)
+                   for t, c in counts.items()])
+
+    # terms between the last batch and this one have no postings left
+    if counts or done:
+        stale_query = SearchTerm.query()
+        if counted:
+            stale_query = stale_query.filter(
+                SearchTerm.key > get_term_key(counted))
+        if not done:
+            stale_query = stale_query.filter(
+                SearchTerm.key <= get_term_key(max(counts)))
+        ndb.delete_multi([key for key in stale_query.fetch(keys_only=True)
+                          if key.id() not in counts])
+        counted = max(counts) if counts else counted
+
+    logging.info('sweep_search_index: %d postings read, %d orphans deleted, '
+                 '%d terms counted', len(postings), len(orphans),
+                 len(counts))
+
+    if not done:
+        deferred.defer(sweep_search_index, next_cursor.urlsafe(), term,
+                       count, counted)
@@ -0,0 +1,86 @@
+import base64
+import hashlib
+import hmac
+import json
+import time
+
+import BlogHelper
+
+# name of the cookie holding the session token
+SESSION_COOKIE = 'session'
+
+# seconds a session token is valid
+SESSION_LIFETIME = 30 * 24 * 60 * 60
+
+# token format version, part of the signed string
+TOKEN_VERSION = 'v1'
+
+
+class Principal(object):
+
+    '''
+    logged in user as described by a verified session token,
+    use it instead of loading the User entity whenever
+    the user id and username are enough
+    '''
+
+    def __init__(self, user_id, username, issued, expires):
+        self.user_id = user_id
+        self.username = username
+        self.issued = issued
+        self.expires = expires
+
+    def __repr__(self):
+        return 'Principal(%r, %r)' % (self.user_id, self.username)
+
+
+def sign(payload):
+    '''
+    signature of a token payload, keyed with the blog secret
+    '''
+    message = '%s.%s' % (TOKEN_VERSION, payload)
+    return hmac.new(BlogHelper.get_secret(), message,
+                    hashlib.sha256).hexdigest()
+
+
+def make_token(user_id, username, now=None):
+    '''
+    build a signed session token:
+    version.payload.signature, payload is base64 encoded json
+    '''
+    issued = int(now or time.time())
+    data = dict(uid=user_id,
+                un=username,
+                iat=issued,
+                exp=issued + SESSION_LIFETIME)
+    payload = base64.urlsafe_b64encode(
+        json.dumps(data, separators=(',', ':'))).rstrip('=')
+    return '%s.%s.%s' % (TOKEN_VERSION, payload, sign(payload))
+
+
+def parse_token(token, now=None):
+    '''
+    return Principal for a valid token,
+    None if the token is malformed, forged or expired
+    '''
+    try:
+        version, payload, signature = str(token).split('.')
+    except (ValueError, UnicodeError):
+        return None
+
+    if version != TOKEN_VERSION:
+        return None
+    if not hmac.compare_digest(signature, sign(payload)):
+        return None
+
+    try:
+        padding = '=' * (-len(payload) % 4)
+        data = json.loads(base64.urlsafe_b64decode(payload + padding))
+        principal = Principal(data['uid'], data['un'],
+                              data['iat'], data['exp'])
+    except (TypeError, ValueError, KeyError):
+        return None
+
+    if principal.expires < (now or time.time()):
+        return None
+    return principal
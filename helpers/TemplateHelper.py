@@ -0,0 +1,126 @@
+import logging
+import os
+
+import jinja2
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+from google.appengine.ext.ndb import eventloop
+
+import config
+import TraceHelper
+
+# build path to templates directory
+template_dir = os.path.join(os.path.dirname(__file__), "../templates")
+
+# marks the end of the page header in base.html, streamed output is
+# flushed there, so the header goes out before the content is rendered
+FLUSH_MARKER = '<!--flush-->'
+
+# bytes of streamed output collected before they are flushed
+STREAM_CHUNK_SIZE = 8 * 1024
+
+# templates precompiled to python modules by tools/compile_templates.py
+compiled_template_dir = os.path.join(
+    os.path.dirname(__file__), "../compiled_templates")
+
+
+def make_loader():
+    '''
+    template loader, precompiled templates are preferred in production
+    (remember to run tools/compile_templates.py before deploying)
+    '''
+    loader = jinja2.FileSystemLoader(template_dir)
+    if config.PRODUCTION and os.path.isdir(compiled_template_dir):
+        return jinja2.ChoiceLoader(
+            [jinja2.ModuleLoader(compiled_template_dir), loader])
+    if config.PRODUCTION:
+        logging.warning('%s not deployed, templates are compiled at '
+                        'runtime', compiled_template_dir)
+    return loader
+
+
+def make_bytecode_cache():
+    '''
+    share compiled templates between instances through memcache,
+    so cold instances skip compiling templates that are not precompiled
+    '''
+    if config.PRODUCTION:
+        return jinja2.MemcachedBytecodeCache(
+            memcache, prefix='jinja2/bytecode/%s/' % os.environ.get(
+                'CURRENT_VERSION_ID', ''))
+
+
+# initialize jinja environment, shared by handlers and helpers
+jinja_env = jinja2.Environment(
+    loader=make_loader(),
+    bytecode_cache=make_bytecode_cache(),
+    auto_reload=config.TEMPLATE_AUTO_RELOAD,
+    autoescape=True)
+
+
+def get_template(template):
+    return jinja_env.get_template(template)
+
+
+def render_str(template, **params):
+    '''
+    return html output to render, as a string
+    '''
+    with TraceHelper.span('template', template):
+        return get_template(template).render(params)
+
+
+def generate(template, **params):
+    '''
+    render template chunk by chunk, generator of utf-8 encoded strings.
+    output is flushed at FLUSH_MARKER and every STREAM_CHUNK_SIZE bytes
+    '''
+    chunk = []
+    size = 0
+    for output in get_template(template).generate(params):
+        flush = FLUSH_MARKER in output
+        if flush:
+            output = output.replace(FLUSH_MARKER, '')
+        output = output.encode('utf-8')
+        chunk.append(output)
+        size += len(output)
+        if flush or size >= STREAM_CHUNK_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        yield ''.join(chunk)
+
+
+def generate_in_context(context, chunks):
+    '''
+    iterate chunks with the ndb context installed and finish its pending
+    work at the end, like ndb.toplevel does for the handler
+    '''
+    ndb.set_context(context)
+    try:
+        for chunk in chunks:
+            yield chunk
+    finally:
+        ndb.set_context(None)
+        context.flush().check_success()
+        eventloop.run()
+
+
+class Stream(object):
+
+    '''
+    response app_iter of a streamed template (see generate). it must not
+    be a generator itself: ndb.toplevel (blog.py) runs a generator the
+    app returns as a tasklet. the template renders in the ndb context of
+    the handler, ndb.toplevel has uninstalled it by then
+    '''
+
+    def __init__(self, template, params):
+        self.template = template
+        self.params = params
+        self.context = ndb.get_context()
+
+    def __iter__(self):
+        return generate_in_context(
+            self.context, generate(self.template, **self.params))
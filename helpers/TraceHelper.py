@@ -0,0 +1,265 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.ext.ndb import context as ndb_context
+from google.appengine.ext.ndb import tasklets
+
+import config
+
+# services whose rpcs are traced
+TRACED_SERVICES = ('datastore_v3', 'memcache')
+
+# slowest calls listed in the slow request log line
+SLOW_LOG_CALLS = 10
+
+# calls are attributed to the innermost frame of app code (files below
+# app_dir), frames of these generic helpers are skipped
+app_dir = os.path.normpath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+SKIP_MODULES = ('TraceHelper', 'CacheHelper', 'TemplateHelper')
+
+# ndb modules whose tasklets send batched calls and run tasklets
+NDB_CONTEXT_FILE = os.path.splitext(ndb_context.__file__)[0]
+NDB_TASKLETS_FILE = os.path.splitext(tasklets.__file__)[0]
+
+# traces are kept per thread, app.yaml runs us with threadsafe: true
+_local = threading.local()
+
+
+class Trace(object):
+
+    '''
+    calls made while serving one request,
+    every call is (kind, name, call site, duration in seconds)
+    '''
+
+    def __init__(self):
+        self.started = time.time()
+        self.calls = []
+        self.pending = {}
+
+    def add(self, kind, name, site, duration):
+        self.calls.append((kind, name, site, duration))
+
+    def get_totals(self):
+        '''
+        {kind: (number of calls, seconds)}
+        '''
+        totals = {}
+        for kind, name, site, duration in self.calls:
+            count, seconds = totals.get(kind, (0, 0.0))
+            totals[kind] = (count + 1, seconds + duration)
+        return totals
+
+    def get_summary(self):
+        '''
+        one line summary, e.g. total=52.1ms datastore_v3=4/20.3ms
+        '''
+        totals = self.get_totals()
+        parts = ['total=%.1fms' % ((time.time() - self.started) * 1000)]
+        parts.extend('%s=%d/%.1fms' % (kind, count, seconds * 1000)
+                     for kind, (count, seconds) in sorted(totals.items()))
+        return ' '.join(parts)
+
+
+def get_trace():
+    '''
+    trace of the request served by the current thread, None if there is none
+    '''
+    return getattr(_local, 'trace', None)
+
+
+def get_module_file(frame):
+    return os.path.splitext(frame.f_code.co_filename)[0]
+
+
+def get_tasklet_site(frame):
+    '''
+    call site of the ndb tasklet or batch of calls frame runs, None if it
+    runs none. their code runs from whichever code runs the event loop, so
+    they carry the call site of the code which created them (see
+    _traced_future_init)
+    '''
+    name = frame.f_code.co_name
+    if (name.endswith('_tasklet') and
+            get_module_file(frame) == NDB_CONTEXT_FILE):
+        # a batch of gets, puts, deletes or memcache calls
+        sites = set(getattr(future, 'trace_site', None)
+                    for future, arg in frame.f_locals.get('todo') or [])
+        if sites and None not in sites:
+            return ' + '.join(sorted(sites))
+    elif (name == '_help_tasklet_along' and
+            get_module_file(frame) == NDB_TASKLETS_FILE):
+        return getattr(frame.f_locals.get('self'), 'trace_site', None)
+
+
+def get_call_site():
+    '''
+    Module.function of the app code making the current call
+    '''
+    frame = sys._getframe(1)
+    while frame:
+        tasklet_site = get_tasklet_site(frame)
+        if tasklet_site:
+            return tasklet_site
+        filename = frame.f_code.co_filename
+        if filename.startswith(app_dir):
+            module = os.path.splitext(os.path.basename(filename))[0]
+            if module not in SKIP_MODULES:
+                return '%s.%s' % (module, frame.f_code.co_name)
+        frame = frame.f_back
+    return 'unknown'
+
+
+def _traced_future_init(init):
+    '''
+    wrap ndb's Future.__init__, futures of traced requests remember the
+    call site of the code creating them
+    '''
+
+    def traced_init(future, info=None):
+        init(future, info)
+        if get_trace():
+            future.trace_site = get_call_site()
+
+    return traced_init
+
+
+def _pre_call(service, call, request, response, rpc):
+    '''
+    apiproxy pre call hook, remembers when the rpc started and who made it
+    '''
+    trace = get_trace()
+    if trace:
+        trace.pending[id(rpc)] = (time.time(), get_call_site())
+
+
+def _post_call(service, call, request, response, rpc, error):
+    '''
+    apiproxy post call hook, adds the finished rpc to the trace
+    '''
+    trace = get_trace()
+    started = trace and trace.pending.pop(id(rpc), None)
+    if started:
+        started, site = started
+        trace.add(service, call, site, time.time() - started)
+
+
+class span(object):
+
+    '''
+    trace a call that is not an rpc (templates, gzip)
+
+    with TraceHelper.span('template', 'post.html'):
+        ...
+    '''
+
+    def __init__(self, kind, name):
+        self.kind = kind
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.time()
+        self.site = get_call_site() if get_trace() else None
+        return self
+
+    def __exit__(self, *exc_info):
+        trace = get_trace()
+        if trace:
+            trace.add(self.kind, self.name, self.site,
+                      time.time() - self.started)
+        return False
+
+
+def log_slow_request(environ, status, trace, duration):
+    '''
+    structured log line of a request slower than config.SLOW_REQUEST_MS
+    '''
+    totals = trace.get_totals()
+    slowest = sorted(trace.calls, key=lambda call: -call[3])
+    logging.warning('slow request: %s', json.dumps(dict(
+        method=environ.get('REQUEST_METHOD'),
+        path=environ.get('PATH_INFO'),
+        status=status,
+        total_ms=round(duration * 1000, 1),
+        budget_ms=config.SLOW_REQUEST_MS,
+        totals=dict((kind, dict(calls=count, ms=round(seconds * 1000, 1)))
+                    for kind, (count, seconds) in totals.items()),
+        slowest=[dict(kind=kind, call=name, site=site,
+                      ms=round(seconds * 1000, 1))
+                 for kind, name, site, seconds in slowest[:SLOW_LOG_CALLS]]),
+        sort_keys=True))
+
+
+class TracedBody(object):
+
+    '''
+    response body of a traced request, the trace stays open while the
+    server reads the body (streamed pages render while they are sent) and
+    is finished when the server closes it
+    '''
+
+    def __init__(self, body, finish):
+        self.body = body
+        self.finish = finish
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self.finish()
+
+
+class TraceMiddleware(object):
+
+    '''
+    wsgi middleware, traces datastore, memcache, template and gzip calls
+    of every request, until its body is sent. adds an X-Trace summary
+    header (of the calls made before the body) if config.TRACE_HEADER is
+    set and logs requests slower than config.SLOW_REQUEST_MS
+    '''
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        trace = _local.trace = Trace()
+        statuses = []
+
+        def traced_start_response(status, headers, exc_info=None):
+            statuses.append(status)
+            if config.TRACE_HEADER:
+                headers = headers + [('X-Trace', trace.get_summary())]
+            return start_response(status, headers, exc_info)
+
+        def finish():
+            _local.trace = None
+            duration = time.time() - trace.started
+            if duration * 1000 > config.SLOW_REQUEST_MS:
+                log_slow_request(environ, statuses[0] if statuses else None,
+                                 trace, duration)
+
+        try:
+            body = self.app(environ, traced_start_response)
+        except Exception:
+            finish()
+            raise
+        return TracedBody(body, finish)
+
+
+tasklets.Future.__init__ = _traced_future_init(tasklets.Future.__init__)
+
+for service in TRACED_SERVICES:
+    apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+        'trace_%s' % service, _pre_call, service)
+    apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+        'trace_%s' % service, _post_call, service)
@@ -1,6 +1,19 @@
+import logging
+
 from models import User
-from google.appengine.ext import db
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import deferred
+from google.appengine.ext import ndb
 import BlogHelper
+import CacheHelper
+
+# users are keyed by username (key name), users created before that
+# have numeric ids and are found by a query, until migrate_users has
+# rewritten them. set to False once the migration is done.
+LEGACY_USER_LOOKUP = True
+
+# users processed per task by the migration job
+JOB_BATCH_SIZE = 100
 
 
 def get_users_key(name='default'):
@@ -8,22 +21,58 @@ def get_users_key(name='default'):
     define a parent group 'users' identified by 'default',
     useful for attaching data of all users
     '''
-    return db.Key.from_path('users', name)
+    return ndb.Key('users', name)
+
+
+def get_user_key(user_id):
+    '''
+    get user key by user id,
+    user id is the username (key name) or the numeric id of legacy users
+    '''
+    if not isinstance(user_id, basestring):
+        user_id = int(user_id)
+    return ndb.Key('User', user_id, parent=get_users_key())
 
 
 def get_user_by_id(user_id):
     '''
-    get user object by user id
+    get user object by user id (cached, see CacheHelper)
     '''
-    return User.get_by_id(user_id, parent=get_users_key())
-    # note: get_by_id is data store build in method
+    return CacheHelper.get(get_user_key(user_id))
+
+
+def invalidate_user(user_id):
+    '''
+    remove user from the cache, call this after writing the user
+    '''
+    CacheHelper.invalidate(get_user_key(user_id))
 
 
 def get_user_by_name(username):
     '''
     get user object by username name
     '''
-    return User.all().filter('username = ', username).get()
+    user = get_user_by_id(unicode(username))
+    if not user and LEGACY_USER_LOOKUP:
+        user = User.query(User.username == username).get()
+    return user
+
+
+def put_new_user(user):
+    '''
+    put a user built by BlogHandler.register (keyed by username),
+    returns False if the username is taken
+    '''
+
+    def txn():
+        if user.key.get():
+            return False
+        user.put()
+        return True
+
+    created = ndb.transaction(txn)
+    invalidate_user(user.key.string_id())
+    return created
 
 
 def validate_db_password(username, password, password_hash):
@@ -49,3 +98,64 @@ def login(username, password):
         user.password_hash
     ):
         return user
+
+
+def migrate_users(cursor=None, delete_legacy=False):
+    '''
+    job: rewrite users with numeric ids as users keyed by username,
+    verifies the copies, and deletes the old users if delete_legacy is set.
+    runs in batches, every batch defers the next one
+    '''
+    query = User.query(ancestor=get_users_key())
+    users, next_cursor, more = query.fetch_page(
+        JOB_BATCH_SIZE,
+        start_cursor=Cursor(urlsafe=cursor) if cursor else None)
+    legacy_users = [user for user in users if user.key.integer_id()]
+
+    def txn():
+        # all users are in one entity group, migrate the batch at once
+        new_keys = [get_user_key(unicode(user.username))
+                    for user in legacy_users]
+        existing = ndb.get_multi(new_keys)
+        copies = []
+        for user, new_key, current in zip(legacy_users, new_keys, existing):
+            if current and current.password_hash != user.password_hash:
+                # duplicate username, signup used to be racy
+                logging.warning('migrate_users: %s (id %d) conflicts with '
+                                'an existing user, not migrated',
+                                user.username, user.key.integer_id())
+                continue
+            copies.append((user, User(key=new_key,
+                                      username=user.username,
+                                      password_hash=user.password_hash,
+                                      email=user.email)))
+        ndb.put_multi([copy for user, copy in copies])
+        return copies
+
+    copies = ndb.transaction(txn)
+
+    # verify the copies before deleting anything
+    verified = []
+    # read from the datastore, not from the context cache
+    stored = ndb.get_multi([copy.key for user, copy in copies],
+                           use_cache=False, use_memcache=False)
+    for (user, copy), current in zip(copies, stored):
+        if (current and current.username == user.username and
+                current.password_hash == user.password_hash and
+                current.email == user.email):
+            verified.append(user)
+        else:
+            logging.error('migrate_users: copy of %s (id %d) does not match',
+                          user.username, user.key.integer_id())
+
+    if delete_legacy and verified:
+        ndb.delete_multi([user.key for user in verified])
+    written_keys = [user.key for user in verified]
+    written_keys.extend(copy.key for user, copy in copies)
+    CacheHelper.invalidate(*written_keys)
+
+    logging.info('migrate_users: %d users read, %d migrated and verified',
+                 len(users), len(verified))
+
+    if more and next_cursor:
+        deferred.defer(migrate_users, next_cursor.urlsafe(), delete_legacy)
@@ -1,14 +1,14 @@
-from google.appengine.ext import db
+from google.appengine.ext import ndb
 
 
-class Comment(db.Model):
+class Comment(ndb.Model):
 
     '''
     Comment entity
     '''
 
-    post_id = db.StringProperty(required=True)
-    username = db.StringProperty(required=True)
-    comment = db.TextProperty(required=True)
-    created = db.DateTimeProperty(auto_now_add=True)
-    last_modified = db.DateTimeProperty(auto_now_add=True)
+    post_id = ndb.StringProperty(required=True)
+    username = ndb.StringProperty(required=True)
+    comment = ndb.TextProperty(required=True)
+    created = ndb.DateTimeProperty(auto_now_add=True)
+    last_modified = ndb.DateTimeProperty(auto_now_add=True)
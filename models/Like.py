@@ -1,12 +1,12 @@
-from google.appengine.ext import db
+from google.appengine.ext import ndb
 
 
-class Like(db.Model):
+class Like(ndb.Model):
 
     '''
     Post entity
     '''
 
-    post_id = db.StringProperty(required=True)
-    username = db.StringProperty(required=True)
-    like = db.BooleanProperty()
+    post_id = ndb.StringProperty(required=True)
+    username = ndb.StringProperty(required=True)
+    like = ndb.BooleanProperty()
@@ -0,0 +1,11 @@
+from google.appengine.ext import ndb
+
+
+class LikeCounterShard(ndb.Model):
+
+    '''
+    LikeCounterShard entity, one shard of the likes count of a post
+    '''
+
+    post_id = ndb.StringProperty(required=True)
+    count = ndb.IntegerProperty(default=0)
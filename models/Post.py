@@ -1,17 +1,33 @@
-from google.appengine.ext import db
-from handlers import BaseHandler
-from helpers import LikeHelper
-from helpers import CommentHelper
+import json
 
+from google.appengine.ext import ndb
 
-class Post(db.Model):
+
+class Post(ndb.Model):
 
     '''
     Post entity
     '''
 
-    username = db.StringProperty(required=True)
-    subject = db.StringProperty(required=True)
-    content = db.TextProperty(required=True)
-    created = db.DateTimeProperty(auto_now_add=True)
-    last_modified = db.DateTimeProperty(auto_now_add=True)
+    username = ndb.StringProperty(required=True)
+    subject = ndb.StringProperty(required=True)
+    # content is the source text as written, content_html is rendered
+    # from it on write, see PostHelper.set_post_content
+    content = ndb.TextProperty(required=True)
+    content_html = ndb.TextProperty()
+    created = ndb.DateTimeProperty(auto_now_add=True)
+    last_modified = ndb.DateTimeProperty(auto_now=True)
+
+    # denormalized comments data, kept up to date by CommentHelper
+    comment_count = ndb.IntegerProperty(default=0)
+    comment_version = ndb.IntegerProperty(default=0)
+    latest_comments_json = ndb.TextProperty(default='[]')
+
+    def get_latest_comments(self):
+        '''
+        summary of the latest comments (list of dicts), newest first
+        '''
+        return json.loads(self.latest_comments_json or '[]')
+
+    def set_latest_comments(self, comments):
+        self.latest_comments_json = json.dumps(comments)
@@ -0,0 +1,13 @@
+from google.appengine.ext import ndb
+
+
+class SearchPosting(ndb.Model):
+
+    '''
+    SearchPosting entity, one term of a post in the search index,
+    keyed by term and post id (see SearchHelper)
+    '''
+
+    term = ndb.StringProperty(required=True)
+    post_id = ndb.StringProperty(required=True)
+    score = ndb.FloatProperty(default=0.0)
@@ -0,0 +1,11 @@
+from google.appengine.ext import ndb
+
+
+class SearchTerm(ndb.Model):
+
+    '''
+    SearchTerm entity, number of posts containing a term in the search
+    index, keyed by term (see SearchHelper)
+    '''
+
+    count = ndb.IntegerProperty(default=0)
@@ -1,12 +1,12 @@
-from google.appengine.ext import db
+from google.appengine.ext import ndb
 
 
-class User(db.Model):
+class User(ndb.Model):
 
     '''
     User entity
     '''
 
-    username = db.StringProperty(required=True)
-    password_hash = db.StringProperty(required=True)
-    email = db.StringProperty()
+    username = ndb.StringProperty(required=True)
+    password_hash = ndb.StringProperty(required=True)
+    email = ndb.StringProperty()
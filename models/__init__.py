@@ -2,3 +2,6 @@ from User import User
 from Post import Post
 from Like import Like
 from Comment import Comment
+from LikeCounterShard import LikeCounterShard
+from SearchPosting import SearchPosting
+from SearchTerm import SearchTerm
@@ -0,0 +1,29 @@
+// load the next page of comments in place of the "more comments" link,
+// pages come from the /comments/<post id> fragment endpoint
+document.addEventListener('click', function (event) {
+  var link = event.target;
+  if (!link.classList || !link.classList.contains('morecomments')) {
+    return;
+  }
+  event.preventDefault();
+  if (link.getAttribute('data-loading')) {
+    return;
+  }
+  link.setAttribute('data-loading', '1');
+
+  var request = new XMLHttpRequest();
+  request.open('GET', link.getAttribute('data-fragment'));
+  request.onload = function () {
+    if (request.status !== 200) {
+      // fall back to the full page
+      window.location = link.href;
+      return;
+    }
+    link.insertAdjacentHTML('beforebegin', request.responseText);
+    link.parentNode.removeChild(link);
+  };
+  request.onerror = function () {
+    window.location = link.href;
+  };
+  request.send();
+});
@@ -0,0 +1,90 @@
+'''
+tests of LikeHelper against the App Engine testbed stubs
+
+usage: python -m unittest discover tests (the SDK is found like the
+tools find it, $APPENGINE_SDK or dev_appserver.py on the PATH)
+'''
+import os
+import sys
+import unittest
+
+root_dir = os.path.normpath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(root_dir, 'tools'))
+
+from bench_coldstart import find_sdk
+from bench_coldstart import setup_sdk
+
+
+# activated once: RpcHelper counts rpcs of the apiproxy of its import
+bed = None
+
+
+def setUpModule():
+    global bed
+    sdk = find_sdk()
+    if not sdk:
+        raise unittest.SkipTest('App Engine SDK not found')
+    setup_sdk(sdk)
+    sys.path.insert(0, root_dir)
+
+    from google.appengine.datastore import datastore_stub_util
+    from google.appengine.ext import testbed
+
+    bed = testbed.Testbed()
+    bed.activate()
+    bed.init_datastore_v3_stub(
+        consistency_policy=datastore_stub_util.
+        PseudoRandomHRConsistencyPolicy(probability=1))
+    bed.init_memcache_stub()
+
+
+def tearDownModule():
+    if bed:
+        bed.deactivate()
+
+
+class LikedPostIdsTest(unittest.TestCase):
+
+    def setUp(self):
+        from google.appengine.api import memcache
+        from google.appengine.ext import ndb
+        from google.appengine.ext import testbed
+        from helpers import LikeHelper
+        from models import Like
+
+        bed.get_stub(testbed.DATASTORE_SERVICE_NAME).Clear()
+        memcache.flush_all()
+        ndb.get_context().clear_cache()
+
+        self.post_ids = [str(post_id) for post_id in range(1, 21)]
+        # a like keyed by post and user, and one with a numeric id
+        LikeHelper.add_like('2', 'alice')
+        Like(parent=LikeHelper.get_likes_key(), post_id='3',
+             username='alice', like=True).put()
+        Like(parent=LikeHelper.get_likes_key(), post_id='4',
+             username='bob', like=True).put()
+
+    def get_liked_post_ids(self, post_ids):
+        '''
+        (liked post ids, datastore rpcs made)
+        '''
+        from helpers import LikeHelper
+        from helpers import RpcHelper
+
+        with RpcHelper.RpcCounter() as rpcs:
+            liked = LikeHelper.get_liked_post_ids(post_ids, 'alice')
+        return liked, rpcs.count
+
+    def test_finds_keyed_and_legacy_likes(self):
+        liked, _ = self.get_liked_post_ids(self.post_ids)
+        self.assertEqual(liked, set(['2', '3']))
+
+    def test_rpcs_do_not_grow_with_page_size(self):
+        _, rpcs_5 = self.get_liked_post_ids(self.post_ids[:5])
+        _, rpcs_20 = self.get_liked_post_ids(self.post_ids)
+        self.assertEqual(rpcs_5, rpcs_20)
+
+
+if __name__ == '__main__':
+    unittest.main()
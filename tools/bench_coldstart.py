@@ -0,0 +1,138 @@
+'''
+measure cold start latency of every route: each sample runs in a fresh
+python process, which imports blog.py and serves one request against
+the local App Engine testbed stubs (empty datastore).
+
+usage: python tools/bench_coldstart.py [--sdk PATH] [--samples 5]
+prints a json report, times in milliseconds:
+ - import_ms: import of blog.py
+ - first_response_ms: import of the handler and serving the request
+ - modules: number of modules loaded after the request
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+root_dir = os.path.normpath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# one sample url per route in blog.py
+ROUTES = [
+    '/',
+    '/archive',
+    '/archive/2017/01',
+    '/search?q=post',
+    '/signup',
+    '/login',
+    '/logout',
+    '/newpost',
+    '/post/1',
+    '/editpost/1',
+    '/deletepost/1',
+    '/postdeleted',
+    '/likepost/1',
+    '/unlikepost/1',
+    '/comments/1',
+    '/newcomment/1',
+    '/editcomment/1/1',
+    '/deletecomment/1/1',
+]
+
+
+def find_sdk():
+    '''
+    App Engine SDK directory, from $APPENGINE_SDK or dev_appserver.py
+    '''
+    if os.environ.get('APPENGINE_SDK'):
+        return os.environ['APPENGINE_SDK']
+    for path in os.environ.get('PATH', '').split(os.pathsep):
+        dev_appserver = os.path.join(path, 'dev_appserver.py')
+        if os.path.exists(dev_appserver):
+            return os.path.dirname(os.path.realpath(dev_appserver))
+
+
+def setup_sdk(sdk):
+    sys.path.insert(0, sdk)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+
+
+def run_sample(url):
+    '''
+    child process: import blog.py and serve one request, print timings
+    '''
+    from google.appengine.ext import testbed
+
+    bed = testbed.Testbed()
+    bed.activate()
+    bed.setup_env(app_id='blog-bench', overwrite=True)
+    bed.init_datastore_v3_stub()
+    bed.init_memcache_stub()
+    bed.init_taskqueue_stub(root_path=root_dir)
+    bed.init_app_identity_stub()
+
+    # secret.txt is read from the working directory
+    os.chdir(root_dir)
+    sys.path.insert(0, root_dir)
+
+    started = time.time()
+    import blog
+    imported = time.time()
+
+    import webapp2
+    response = webapp2.Request.blank(url).get_response(blog.app)
+    responded = time.time()
+
+    print(json.dumps(dict(
+        url=url,
+        status=response.status_int,
+        import_ms=(imported - started) * 1000,
+        first_response_ms=(responded - imported) * 1000,
+        modules=len(sys.modules))))
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sdk', default=find_sdk(),
+                        help='App Engine SDK directory')
+    parser.add_argument('--samples', type=int, default=5,
+                        help='fresh processes per route')
+    parser.add_argument('--sample', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if not args.sdk:
+        parser.error('App Engine SDK not found, pass --sdk')
+    setup_sdk(args.sdk)
+
+    if args.sample:
+        run_sample(args.sample)
+        return
+
+    report = {}
+    for url in ROUTES:
+        samples = []
+        for _ in range(args.samples):
+            output = subprocess.check_output(
+                [sys.executable, os.path.abspath(__file__),
+                 '--sdk', args.sdk, '--sample', url])
+            samples.append(json.loads(output.splitlines()[-1]))
+        report[url] = dict(
+            status=samples[0]['status'],
+            modules=samples[0]['modules'],
+            import_ms=median([s['import_ms'] for s in samples]),
+            first_response_ms=median(
+                [s['first_response_ms'] for s in samples]))
+
+    print(json.dumps(report, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,530 @@
+'''
+benchmark every route of blog.py against the local App Engine testbed
+stubs, seeded with a reproducible dataset (same --seed, same data and
+same requests).
+
+usage: python tools/bench_suite.py [--sdk PATH] [--dataset small]
+           [--requests 50] [--seed 1] [--rpc-latency MS]
+           [--sequential-fetches] [--output FILE] [--compare FILE]
+datasets (override any size with --users, --posts, --likes, --comments):
+ - small: 50 users, 200 posts, 2k likes, 2k comments
+ - medium: 200 users, 1k posts, 100k likes, 10k comments
+ - large: 1k users, 10k posts, 1M likes, 100k comments
+prints (and writes to --output) a json report: per route latency
+percentiles in milliseconds, datastore rpcs per request and status codes.
+the stubs answer at once, --rpc-latency makes every datastore and
+memcache call take MS milliseconds from its start (calls in flight at the
+same time overlap), so sequential and concurrent fetches differ.
+--sequential-fetches makes render_post(s) wait for every fetch before
+starting the next (PostHelper.CONCURRENT_FETCHES), to compare with.
+--compare prints the p50/p99 change against an earlier report.
+'''
+import argparse
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+from bench_coldstart import find_sdk
+from bench_coldstart import root_dir
+from bench_coldstart import setup_sdk
+
+DATASETS = {
+    'small': dict(users=50, posts=200, likes=2000, comments=2000),
+    'medium': dict(users=200, posts=1000, likes=100000, comments=10000),
+    'large': dict(users=1000, posts=10000, likes=1000000, comments=100000),
+}
+
+# entities per put_multi while seeding
+SEED_BATCH_SIZE = 500
+
+# posts are created over a year from this date
+SEED_START = datetime.datetime(2016, 1, 1)
+
+PASSWORD = 'password'
+
+
+def setup_testbed():
+    from google.appengine.datastore import datastore_stub_util
+    from google.appengine.ext import testbed
+
+    bed = testbed.Testbed()
+    bed.activate()
+    bed.setup_env(app_id='blog-bench', overwrite=True)
+    # writes are applied at once, so runs do not depend on chance
+    bed.init_datastore_v3_stub(
+        consistency_policy=datastore_stub_util.
+        PseudoRandomHRConsistencyPolicy(probability=1))
+    bed.init_memcache_stub()
+    bed.init_taskqueue_stub(root_path=root_dir)
+    bed.init_app_identity_stub()
+
+    # secret.txt is read from the working directory
+    os.chdir(root_dir)
+    sys.path.insert(0, root_dir)
+    return bed
+
+
+# services --rpc-latency applies to
+LATENCY_SERVICES = ('datastore_v3', 'memcache')
+
+
+def simulate_rpc_latency(seconds):
+    '''
+    calls of LATENCY_SERVICES finish at least seconds after they started,
+    waiting on a call started earlier waits only for the rest
+    '''
+    from google.appengine.api import apiproxy_rpc
+
+    make_call = apiproxy_rpc.RPC._MakeCallImpl
+    wait = apiproxy_rpc.RPC._WaitImpl
+
+    def timed_make_call(rpc):
+        rpc.started = time.time()
+        make_call(rpc)
+
+    def delayed_wait(rpc):
+        if rpc.package in LATENCY_SERVICES:
+            started = getattr(rpc, 'started', time.time())
+            time.sleep(max(started + seconds - time.time(), 0))
+        return wait(rpc)
+
+    apiproxy_rpc.RPC._MakeCallImpl = timed_make_call
+    apiproxy_rpc.RPC._WaitImpl = delayed_wait
+
+
+class Dataset(object):
+
+    '''
+    what was seeded, requests pick their posts, comments and users here
+    '''
+
+    def __init__(self, sizes):
+        self.sizes = sizes
+        self.usernames = []
+        self.post_ids = []
+        self.posts_by_user = {}
+        self.comments_by_user = {}
+        self.months = []
+        self.signups = 0
+
+    def own_post(self, rng, username):
+        posts = self.posts_by_user.get(username)
+        return posts and rng.choice(posts)
+
+    def pop_own_post(self, rng, username):
+        posts = self.posts_by_user.get(username)
+        return posts and posts.pop(rng.randrange(len(posts)))
+
+    def pop_own_comment(self, rng, username):
+        comments = self.comments_by_user.get(username)
+        return comments and comments.pop(rng.randrange(len(comments)))
+
+
+def put_batched(entities):
+    from google.appengine.ext import ndb
+
+    for i in range(0, len(entities), SEED_BATCH_SIZE):
+        ndb.put_multi(entities[i:i + SEED_BATCH_SIZE])
+
+
+def seed(sizes, rng):
+    '''
+    put users, posts, comments and likes of the given sizes,
+    returns the Dataset
+    '''
+    from google.appengine.api import memcache
+    from google.appengine.ext import ndb
+    from helpers import BlogHelper
+    from helpers import CommentHelper
+    from helpers import CounterHelper
+    from helpers import LikeHelper
+    from helpers import PostHelper
+    from helpers import SearchHelper
+    from helpers import UserHelper
+    from models import Comment
+    from models import Like
+    from models import LikeCounterShard
+    from models import Post
+    from models import User
+
+    # keep a million entities out of the context cache and memcache
+    context = ndb.get_context()
+    context.set_cache_policy(False)
+    context.set_memcache_policy(False)
+
+    ds = Dataset(sizes)
+    password_hash = BlogHelper.hash_str(PASSWORD)
+    ds.usernames = ['user%04d' % i for i in range(sizes['users'])]
+    put_batched([User(id=username, parent=UserHelper.get_users_key(),
+                      username=username, password_hash=password_hash)
+                 for username in ds.usernames])
+
+    # ids are given, keep the datastore from handing them out again
+    # (ids of posts and comments are allocated from the legacy parents)
+    Post.allocate_ids(max=sizes['posts'], parent=PostHelper.get_posts_key())
+    Comment.allocate_ids(max=sizes['comments'],
+                         parent=CommentHelper.get_comments_key())
+
+    posts = {}
+    step = datetime.timedelta(days=365) // max(sizes['posts'], 1)
+    for i in range(sizes['posts']):
+        post_id = i + 1
+        username = ds.usernames[i % len(ds.usernames)]
+        post = Post(key=PostHelper.get_post_key(post_id),
+                    username=username,
+                    subject='Post subject %d' % post_id,
+                    created=SEED_START + step * i)
+        PostHelper.set_post_content(
+            post, '\n'.join(['some post content'] * rng.randint(1, 30)))
+        posts[post_id] = post
+        ds.post_ids.append(post_id)
+        ds.posts_by_user.setdefault(username, []).append(post_id)
+
+    comments = []
+    comments_by_post = {}
+    for i in range(sizes['comments']):
+        post_id = rng.choice(ds.post_ids)
+        username = rng.choice(ds.usernames)
+        comment = Comment(key=CommentHelper.get_comment_key(i + 1, post_id),
+                          post_id=str(post_id), username=username,
+                          comment='comment %d' % (i + 1),
+                          created=posts[post_id].created +
+                          datetime.timedelta(seconds=i))
+        comments.append(comment)
+        comments_by_post.setdefault(post_id, []).append(comment)
+        ds.comments_by_user.setdefault(username, []).append(
+            (i + 1, post_id))
+    put_batched(comments)
+
+    # comments summary stored on the posts, see CommentHelper
+    for post_id, post_comments in comments_by_post.items():
+        post = posts[post_id]
+        post.comment_count = len(post_comments)
+        latest = sorted(post_comments, key=lambda c: c.created,
+                        reverse=True)[:CommentHelper.LATEST_COMMENTS]
+        post.set_latest_comments(
+            [CommentHelper.get_comment_summary(c) for c in latest])
+    put_batched(posts.values())
+    del comments, comments_by_post
+
+    post_list = list(posts.values())
+    for i in range(0, len(post_list), SEED_BATCH_SIZE):
+        SearchHelper.index_posts(post_list[i:i + SEED_BATCH_SIZE])
+
+    # likes of distinct (post, user) pairs, counters in shard 0
+    likes_count = min(sizes['likes'], len(ds.post_ids) * len(ds.usernames))
+    pairs = set()
+    counts = {}
+    likes = []
+    while len(pairs) < likes_count:
+        post_id = rng.choice(ds.post_ids)
+        user_index = rng.randrange(len(ds.usernames))
+        pair = post_id * len(ds.usernames) + user_index
+        if pair in pairs:
+            continue
+        pairs.add(pair)
+        counts[post_id] = counts.get(post_id, 0) + 1
+        likes.append(Like(key=LikeHelper.get_like_key(
+            post_id, ds.usernames[user_index]),
+            post_id=str(post_id), username=ds.usernames[user_index],
+            like=True))
+        if len(likes) == SEED_BATCH_SIZE:
+            ndb.put_multi(likes)
+            likes = []
+    ndb.put_multi(likes)
+    del pairs
+    put_batched([LikeCounterShard(
+        key=CounterHelper.get_shard_key(post_id, 0),
+        post_id=str(post_id), count=count)
+        for post_id, count in counts.items()])
+
+    ds.months = PostHelper.get_archive_months()
+
+    context.set_cache_policy(None)
+    context.set_memcache_policy(None)
+    context.clear_cache()
+    memcache.flush_all()
+    return ds
+
+
+def session_cookie(username):
+    from helpers import SessionHelper
+
+    return '%s=%s' % (SessionHelper.SESSION_COOKIE,
+                      SessionHelper.make_token(username, username))
+
+
+def get(url, username=None):
+    return ('GET', url, None, username)
+
+
+def post(url, params, username=None):
+    return ('POST', url, params, username)
+
+
+def new_username(ds):
+    ds.signups += 1
+    return 'bench%05d' % ds.signups
+
+
+def page_cursor(ds, rng):
+    '''
+    cursor of a random page of the front page
+    '''
+    from helpers import PostHelper
+
+    from_post = rng.randrange(len(ds.post_ids))
+    created = SEED_START + (datetime.timedelta(days=365) //
+                            max(len(ds.post_ids), 1)) * from_post
+    return PostHelper.make_page_cursor('next', created)
+
+
+# route => build(dataset, rng, username) returning
+# (method, url, post params, username of the session or None).
+# one entry per route of blog.py, read only routes first, requests
+# deleting data last
+ROUTES = [
+    ('GET / (anonymous)', lambda ds, rng, user: get('/')),
+    ('GET /', lambda ds, rng, user: get('/', user)),
+    ('GET /?c=', lambda ds, rng, user: get(
+        '/?c=%s' % page_cursor(ds, rng), user)),
+    ('GET /archive', lambda ds, rng, user: get('/archive', user)),
+    ('GET /archive/yyyy/mm', lambda ds, rng, user: get(
+        '/archive/%04d/%02d' % rng.choice(ds.months), user)),
+    ('GET /search?q=', lambda ds, rng, user: get(
+        '/search?q=post+subject+%d' % rng.choice(ds.post_ids), user)),
+    ('GET /signup', lambda ds, rng, user: get('/signup')),
+    ('GET /login', lambda ds, rng, user: get('/login')),
+    ('GET /logout', lambda ds, rng, user: get('/logout', user)),
+    ('GET /newpost', lambda ds, rng, user: get('/newpost', user)),
+    ('GET /post/id (anonymous)', lambda ds, rng, user: get(
+        '/post/%d' % rng.choice(ds.post_ids))),
+    ('GET /post/id', lambda ds, rng, user: get(
+        '/post/%d' % rng.choice(ds.post_ids), user)),
+    ('GET /post/id?comments=all', lambda ds, rng, user: get(
+        '/post/%d?comments=all' % rng.choice(ds.post_ids), user)),
+    ('GET /comments/id', lambda ds, rng, user: get(
+        '/comments/%d' % rng.choice(ds.post_ids), user)),
+    ('GET /editpost/id', lambda ds, rng, user: get(
+        '/editpost/%d' % ds.own_post(rng, user), user)),
+    ('GET /deletepost/id', lambda ds, rng, user: get(
+        '/deletepost/%d' % ds.own_post(rng, user), user)),
+    ('GET /postdeleted', lambda ds, rng, user: get('/postdeleted', user)),
+    ('GET /newcomment/id', lambda ds, rng, user: get(
+        '/newcomment/%d' % rng.choice(ds.post_ids), user)),
+    ('GET /editcomment/id/id', lambda ds, rng, user: get(
+        '/editcomment/%d/%d' % rng.choice(ds.comments_by_user[user]),
+        user)),
+    ('GET /deletecomment/id/id', lambda ds, rng, user: get(
+        '/deletecomment/%d/%d' % rng.choice(ds.comments_by_user[user]),
+        user)),
+    ('GET /admin/jobs', lambda ds, rng, user: get('/admin/jobs')),
+    ('GET /admin/cachestats', lambda ds, rng, user: get(
+        '/admin/cachestats')),
+    ('POST /login', lambda ds, rng, user: post(
+        '/login', dict(username=user, password=PASSWORD))),
+    ('POST /signup', lambda ds, rng, user: post(
+        '/signup', dict(username=new_username(ds), password=PASSWORD,
+                        verify=PASSWORD))),
+    ('GET /likepost/id', lambda ds, rng, user: get(
+        '/likepost/%d' % rng.choice(ds.post_ids), user)),
+    ('GET /unlikepost/id', lambda ds, rng, user: get(
+        '/unlikepost/%d' % rng.choice(ds.post_ids), user)),
+    ('POST /newpost', lambda ds, rng, user: post(
+        '/newpost', dict(subject='bench post', content='bench\ncontent'),
+        user)),
+    ('POST /editpost/id', lambda ds, rng, user: post(
+        '/editpost/%d' % ds.own_post(rng, user),
+        dict(subject='edited', content='edited\ncontent'), user)),
+    ('POST /newcomment/id', lambda ds, rng, user: post(
+        '/newcomment/%d' % rng.choice(ds.post_ids),
+        dict(comment='bench comment'), user)),
+    ('POST /editcomment/id/id', lambda ds, rng, user: post(
+        '/editcomment/%d/%d' % rng.choice(ds.comments_by_user[user]),
+        dict(comment='edited comment'), user)),
+    ('POST /deletecomment/id/id', lambda ds, rng, user: post(
+        '/deletecomment/%d/%d' % ds.pop_own_comment(rng, user), {}, user)),
+    ('POST /deletepost/id', lambda ds, rng, user: post(
+        '/deletepost/%d' % ds.pop_own_post(rng, user),
+        dict(subject='deleted', content='deleted'), user)),
+]
+
+
+def make_request(method, url, params, username):
+    import webapp2
+
+    if method == 'POST':
+        request = webapp2.Request.blank(url, POST=params)
+    else:
+        request = webapp2.Request.blank(url)
+    if username:
+        request.headers['Cookie'] = session_cookie(username)
+    return request
+
+
+def measure(app, request):
+    '''
+    serve one request, returns (seconds, datastore rpcs, status)
+    '''
+    from helpers import RpcHelper
+
+    with RpcHelper.RpcCounter() as rpcs:
+        started = time.time()
+        response = request.get_response(app)
+        duration = time.time() - started
+    return duration, rpcs.count, response.status_int
+
+
+def percentile(values, p):
+    '''
+    p-th percentile (nearest rank) of values
+    '''
+    values = sorted(values)
+    index = max(int(round(p / 100.0 * len(values))) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+def pick_user(ds, rng):
+    '''
+    a user with posts and comments left, so every route has something
+    to work on
+    '''
+    usernames = [username for username in ds.usernames
+                 if ds.posts_by_user.get(username) and
+                 ds.comments_by_user.get(username)]
+    if not usernames:
+        sys.exit('dataset too small, every user ran out of posts or '
+                 'comments, seed more or pass fewer --requests')
+    return rng.choice(usernames)
+
+
+def bench_route(app, ds, rng, build, requests, warmup):
+    samples = []
+    for i in range(warmup + requests):
+        request = make_request(*build(ds, rng, pick_user(ds, rng)))
+        sample = measure(app, request)
+        if i >= warmup:
+            samples.append(sample)
+
+    latencies = [s[0] * 1000 for s in samples]
+    rpcs = [s[1] for s in samples]
+    statuses = {}
+    for s in samples:
+        statuses[str(s[2])] = statuses.get(str(s[2]), 0) + 1
+    return dict(
+        p50_ms=percentile(latencies, 50),
+        p90_ms=percentile(latencies, 90),
+        p99_ms=percentile(latencies, 99),
+        max_ms=max(latencies),
+        mean_ms=sum(latencies) / len(latencies),
+        rpcs_mean=float(sum(rpcs)) / len(rpcs),
+        rpcs_max=max(rpcs),
+        statuses=statuses)
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=root_dir).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline):
+    '''
+    p50/p99 change of every route against a baseline report
+    '''
+    changes = {}
+    for route, result in sorted(report['routes'].items()):
+        before = baseline['routes'].get(route)
+        if not before:
+            continue
+        changes[route] = dict(
+            (key, '%+.1f%%' % ((result[key] - before[key]) * 100.0 /
+                               before[key]) if before[key] else None)
+            for key in ('p50_ms', 'p99_ms', 'rpcs_mean'))
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sdk', default=find_sdk(),
+                        help='App Engine SDK directory')
+    parser.add_argument('--dataset', choices=sorted(DATASETS),
+                        default='small')
+    for size in ('users', 'posts', 'likes', 'comments'):
+        parser.add_argument('--%s' % size, type=int,
+                            help='override the dataset size')
+    parser.add_argument('--requests', type=int, default=50,
+                        help='measured requests per route')
+    parser.add_argument('--warmup', type=int, default=5,
+                        help='unmeasured requests per route')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='random seed of the dataset and requests')
+    parser.add_argument('--rpc-latency', type=float, default=0,
+                        help='milliseconds per datastore and memcache call')
+    parser.add_argument('--sequential-fetches', action='store_true',
+                        help='render posts with sequential fetches')
+    parser.add_argument('--output', help='write the report to this file')
+    parser.add_argument('--compare', help='report to compare against')
+    args = parser.parse_args()
+
+    if not args.sdk:
+        parser.error('App Engine SDK not found, pass --sdk')
+    setup_sdk(args.sdk)
+    setup_testbed()
+
+    import blog
+    import config
+    from helpers import PostHelper
+
+    PostHelper.CONCURRENT_FETCHES = not args.sequential_fetches
+
+    sizes = dict(DATASETS[args.dataset])
+    for size in sizes:
+        if getattr(args, size) is not None:
+            sizes[size] = getattr(args, size)
+
+    rng = random.Random(args.seed)
+    started = time.time()
+    ds = seed(sizes, rng)
+    seed_seconds = time.time() - started
+
+    if args.rpc_latency:
+        simulate_rpc_latency(args.rpc_latency / 1000.0)
+
+    routes = {}
+    for name, build in ROUTES:
+        routes[name] = bench_route(blog.app, ds, rng, build,
+                                   args.requests, args.warmup)
+
+    report = dict(
+        commit=get_commit(),
+        mode=config.MODE,
+        dataset=args.dataset,
+        sizes=sizes,
+        seed=args.seed,
+        requests=args.requests,
+        rpc_latency_ms=args.rpc_latency,
+        concurrent_fetches=PostHelper.CONCURRENT_FETCHES,
+        seed_seconds=seed_seconds,
+        routes=routes)
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            report['compare'] = compare(report, json.load(baseline))
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+'''
+measure template cold start and per render time of
+ - before: FileSystemLoader with auto reload (templates parsed on start,
+   template files checked on every lookup)
+ - after: precompiled templates (ModuleLoader), auto reload off
+
+usage: python tools/bench_templates.py [--renders 1000]
+prints a json report
+'''
+import argparse
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import timeit
+
+import jinja2
+
+root_dir = os.path.normpath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+template_dir = os.path.join(root_dir, 'templates')
+
+
+class FakeKey(object):
+
+    def __init__(self, key_id):
+        self.key_id = key_id
+
+    def id(self):
+        return self.key_id
+
+
+class FakePost(object):
+
+    '''
+    just enough of a Post entity to render post.html
+    '''
+
+    def __init__(self, post_id):
+        self.post_id = post_id
+        self.username = 'user%d' % post_id
+        self.subject = 'Post subject %d' % post_id
+        self.content_html = '<br>'.join(['some post content'] * 20)
+        self.created = datetime.datetime(2017, 1, 1)
+        self.comment_count = 3
+        self.key = FakeKey(post_id)
+
+    def get_latest_comments(self):
+        return [dict(id=i, post_id=str(self.post_id), username='reader',
+                     comment='a comment', created='Jan 01, 2017')
+                for i in range(3)]
+
+
+def make_env(loader, auto_reload):
+    return jinja2.Environment(
+        loader=loader, auto_reload=auto_reload, autoescape=True)
+
+
+def render_front_page(env):
+    '''
+    render a front page of 10 posts, like BlogFrontHandler does
+    '''
+    post_template = env.get_template('post.html')
+    posts_html = [post_template.render(p=FakePost(i), liked=False,
+                                       likes_count=i, show_comments=False,
+                                       comments=None)
+                  for i in range(10)]
+    return env.get_template('front.html').render(posts_html=posts_html,
+                                                 page_url='/', user=None)
+
+
+def bench(make_loader, auto_reload, renders):
+    # cold start: new environment, first render compiles/loads templates
+    cold_start = min(timeit.repeat(
+        lambda: render_front_page(make_env(make_loader(), auto_reload)),
+        repeat=5, number=1))
+
+    env = make_env(make_loader(), auto_reload)
+    render_front_page(env)
+    per_render = timeit.timeit(
+        lambda: render_front_page(env), number=renders) / renders
+
+    return dict(cold_start_ms=cold_start * 1000,
+                per_render_ms=per_render * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--renders', type=int, default=1000)
+    args = parser.parse_args()
+
+    compiled_dir = tempfile.mkdtemp()
+    try:
+        make_env(jinja2.FileSystemLoader(template_dir), False) \
+            .compile_templates(compiled_dir, zip=None)
+
+        report = dict(
+            before=bench(lambda: jinja2.FileSystemLoader(template_dir),
+                         True, args.renders),
+            after=bench(lambda: jinja2.ModuleLoader(compiled_dir),
+                        False, args.renders))
+    finally:
+        shutil.rmtree(compiled_dir)
+
+    print(json.dumps(report, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
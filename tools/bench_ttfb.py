@@ -0,0 +1,133 @@
+'''
+measure time to first byte of buffered and streamed rendering
+(config.STREAM_TEMPLATES), against the local App Engine testbed stubs
+seeded with posts and comments. requests carry a session cookie, so the
+page cache is bypassed.
+
+usage: python tools/bench_ttfb.py [--sdk PATH] [--requests 50]
+prints a json report per url and mode, times in milliseconds:
+ - ttfb_ms: until the first chunk of the body
+ - total_ms: until the whole body
+ - chunks: number of chunks the body was sent in
+'''
+import argparse
+import json
+import os
+import sys
+import time
+
+from bench_coldstart import find_sdk
+from bench_coldstart import root_dir
+from bench_coldstart import setup_sdk
+
+# posts seeded, the first one gets COMMENTS comments
+POSTS = 20
+COMMENTS = 200
+
+
+def setup_testbed():
+    from google.appengine.ext import testbed
+
+    bed = testbed.Testbed()
+    bed.activate()
+    bed.setup_env(app_id='blog-bench', overwrite=True)
+    bed.init_datastore_v3_stub()
+    bed.init_memcache_stub()
+    bed.init_taskqueue_stub(root_path=root_dir)
+    bed.init_app_identity_stub()
+
+    # secret.txt is read from the working directory
+    os.chdir(root_dir)
+    sys.path.insert(0, root_dir)
+    return bed
+
+
+def seed():
+    '''
+    put POSTS posts, returns the id of the first (commented) one
+    '''
+    from helpers import CommentHelper
+    from helpers import PostHelper
+    from models import Post
+
+    post_ids = []
+    for i in range(POSTS):
+        post = Post(key=PostHelper.allocate_post_key(),
+                    username='bench',
+                    subject='Post subject %d' % i)
+        PostHelper.set_post_content(
+            post, '\n'.join(['some post content'] * 20))
+        post.put()
+        post_ids.append(post.key.id())
+
+    for i in range(COMMENTS):
+        CommentHelper.add_comment(post_ids[0], 'reader', 'comment %d' % i)
+    return post_ids[0]
+
+
+def measure(app, url):
+    '''
+    serve one request, returns (ttfb, total, chunks) in seconds
+    '''
+    import webapp2
+
+    request = webapp2.Request.blank(url)
+    request.headers['Cookie'] = 'session=bench'
+
+    started = time.time()
+    body = app(request.environ, lambda status, headers, exc_info=None: None)
+    ttfb = None
+    chunks = 0
+    try:
+        for chunk in body:
+            if ttfb is None:
+                ttfb = time.time() - started
+            chunks += 1
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+    return ttfb, time.time() - started, chunks
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sdk', default=find_sdk(),
+                        help='App Engine SDK directory')
+    parser.add_argument('--requests', type=int, default=50,
+                        help='requests per url and mode')
+    args = parser.parse_args()
+
+    if not args.sdk:
+        parser.error('App Engine SDK not found, pass --sdk')
+    setup_sdk(args.sdk)
+    setup_testbed()
+
+    import blog
+    import config
+
+    post_id = seed()
+    urls = ['/', '/post/%d' % post_id, '/post/%d?comments=all' % post_id]
+
+    report = {}
+    for url in urls:
+        for mode, stream in (('buffered', False), ('streamed', True)):
+            config.STREAM_TEMPLATES = stream
+            # warm up caches and templates
+            measure(blog.app, url)
+            samples = [measure(blog.app, url)
+                       for _ in range(args.requests)]
+            report['%s %s' % (mode, url)] = dict(
+                ttfb_ms=median([s[0] for s in samples]) * 1000,
+                total_ms=median([s[1] for s in samples]) * 1000,
+                chunks=samples[0][2])
+
+    print(json.dumps(report, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
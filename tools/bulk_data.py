@@ -0,0 +1,269 @@
+'''
+export all posts, comments, likes, likes counters, users and the search
+index to gzipped json lines, and import them again, through remote_api
+(app.yaml).
+
+usage: python tools/bulk_data.py export --host HOST [--sdk PATH] FILE
+       python tools/bulk_data.py import --host HOST [--sdk PATH] FILE
+HOST is the dev server (localhost:8080) or the deployed app
+(APP_ID.appspot.com, uses your gcloud credentials).
+every line is one entity: {"key": [kind, id, ...], "properties": {...}},
+the key path keeps ids and parents (comments and likes under posts).
+export pages through every kind with cursors, memory use does not grow
+with the data. import puts in batches of --batch-size, writes a
+checkpoint (FILE.checkpoint) after every batch and resumes from it,
+then reserves the imported ids and flushes memcache. auto_now
+properties (Post.last_modified) are set to the time of the import.
+prints a json report: entities and entities per second, per kind.
+'''
+import argparse
+import datetime
+import gzip
+import json
+import os
+import sys
+import time
+
+from bench_coldstart import find_sdk
+from bench_coldstart import root_dir
+from bench_coldstart import setup_sdk
+
+# kinds exported, in import order
+KINDS = ('User', 'Post', 'Comment', 'Like', 'LikeCounterShard',
+         'SearchPosting', 'SearchTerm')
+
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+# seconds between progress lines
+PROGRESS_INTERVAL = 10
+
+
+def connect(host):
+    '''
+    route datastore and memcache calls to the app at host
+    '''
+    from google.appengine.ext.remote_api import remote_api_stub
+
+    if host.startswith('localhost') or host.startswith('127.0.0.1'):
+        # the dev server accepts any credentials
+        remote_api_stub.ConfigureRemoteApi(
+            None, '/_ah/remote_api', lambda: ('admin', ''),
+            servername=host, secure=False)
+    else:
+        remote_api_stub.ConfigureRemoteApiForOAuth(host, '/_ah/remote_api')
+
+    from google.appengine.ext import ndb
+
+    # stream entities, keep them out of the caches
+    context = ndb.get_context()
+    context.set_cache_policy(False)
+    context.set_memcache_policy(False)
+
+    sys.path.insert(0, root_dir)
+
+
+def get_model(kind):
+    import models
+    return getattr(models, kind)
+
+
+def encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return {'datetime': value.strftime(DATETIME_FORMAT)}
+    return value
+
+
+def decode_value(value):
+    if isinstance(value, dict) and 'datetime' in value:
+        return datetime.datetime.strptime(value['datetime'], DATETIME_FORMAT)
+    return value
+
+
+def entity_to_json(entity):
+    properties = dict((name, encode_value(value))
+                      for name, value in entity.to_dict().items())
+    return json.dumps(dict(key=list(entity.key.flat()),
+                           properties=properties), sort_keys=True)
+
+
+def entity_from_json(line):
+    from google.appengine.ext import ndb
+
+    data = json.loads(line)
+    key = ndb.Key(flat=data['key'])
+    properties = dict((str(name), decode_value(value))
+                      for name, value in data['properties'].items())
+    return get_model(key.kind())(key=key, **properties)
+
+
+class Progress(object):
+
+    '''
+    entities counted per kind, logs a progress line now and then
+    '''
+
+    def __init__(self, action):
+        self.action = action
+        self.started = time.time()
+        self.logged = self.started
+        self.counts = dict((kind, 0) for kind in KINDS)
+        self.kind_seconds = dict((kind, 0.0) for kind in KINDS)
+
+    def add(self, kind, count, seconds):
+        self.counts[kind] += count
+        self.kind_seconds[kind] += seconds
+        if time.time() - self.logged > PROGRESS_INTERVAL:
+            self.logged = time.time()
+            total = sum(self.counts.values())
+            sys.stderr.write('%s: %d entities, %.0f entities/s\n' % (
+                self.action, total, total / (self.logged - self.started)))
+
+    def get_report(self):
+        seconds = time.time() - self.started
+        total = sum(self.counts.values())
+        return dict(
+            action=self.action,
+            entities=total,
+            seconds=seconds,
+            entities_per_s=total / seconds if seconds else None,
+            kinds=dict((kind, dict(
+                entities=self.counts[kind],
+                entities_per_s=(self.counts[kind] / self.kind_seconds[kind]
+                                if self.kind_seconds[kind] else None)))
+                for kind in KINDS))
+
+
+def export_data(path, batch_size):
+    progress = Progress('export')
+    with gzip.open(path, 'wb') as output:
+        for kind in KINDS:
+            query = get_model(kind).query()
+            cursor = None
+            more = True
+            while more:
+                started = time.time()
+                entities, cursor, more = query.fetch_page(
+                    batch_size, start_cursor=cursor)
+                for entity in entities:
+                    output.write(entity_to_json(entity) + '\n')
+                progress.add(kind, len(entities), time.time() - started)
+                more = more and cursor
+    return progress.get_report()
+
+
+def read_checkpoint(path):
+    '''
+    number of lines of the export already imported
+    '''
+    if not os.path.exists(path):
+        return 0
+    with open(path) as checkpoint:
+        return json.load(checkpoint)['lines']
+
+
+def write_checkpoint(path, lines):
+    with open(path + '.tmp', 'w') as checkpoint:
+        json.dump(dict(lines=lines), checkpoint)
+    os.rename(path + '.tmp', path)
+
+
+def get_id_parent(key):
+    '''
+    parent the id of an entity was allocated from, new posts and
+    comments get ids allocated from the legacy parents
+    '''
+    from helpers import CommentHelper
+    from helpers import PostHelper
+
+    if key.kind() == 'Post':
+        return PostHelper.get_posts_key()
+    if key.kind() == 'Comment':
+        return CommentHelper.get_comments_key()
+    return key.parent()
+
+
+def reserve_ids(max_ids):
+    '''
+    keep the datastore from handing out imported ids again
+    '''
+    for (kind, parent), max_id in max_ids.items():
+        get_model(kind).allocate_ids(max=max_id, parent=parent)
+
+
+def import_data(path, batch_size):
+    from google.appengine.api import memcache
+    from google.appengine.ext import ndb
+
+    checkpoint_path = path + '.checkpoint'
+    done = read_checkpoint(checkpoint_path)
+    if done:
+        sys.stderr.write('import: resuming after line %d\n' % done)
+
+    progress = Progress('import')
+    # highest integer id per (kind, parent)
+    max_ids = {}
+    batch = []
+    lines = 0
+
+    def put_batch():
+        started = time.time()
+        ndb.put_multi(batch)
+        seconds = time.time() - started
+        kinds = {}
+        for entity in batch:
+            kinds[entity.key.kind()] = kinds.get(entity.key.kind(), 0) + 1
+        for kind, count in kinds.items():
+            progress.add(kind, count, seconds * count / len(batch))
+        write_checkpoint(checkpoint_path, lines)
+        del batch[:]
+
+    with gzip.open(path, 'rb') as export:
+        for line in export:
+            lines += 1
+            entity = entity_from_json(line)
+            key = entity.key
+            if key.integer_id():
+                group = (key.kind(), get_id_parent(key))
+                max_ids[group] = max(max_ids.get(group, 0), key.integer_id())
+            if lines <= done:
+                continue
+            batch.append(entity)
+            if len(batch) >= batch_size:
+                put_batch()
+        if batch:
+            put_batch()
+
+    reserve_ids(max_ids)
+    # cached entities, fragments and pages are stale now
+    memcache.flush_all()
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return progress.get_report()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('action', choices=('export', 'import'))
+    parser.add_argument('path', help='gzipped json lines file')
+    parser.add_argument('--host', required=True,
+                        help='app host, e.g. localhost:8080')
+    parser.add_argument('--sdk', default=find_sdk(),
+                        help='App Engine SDK directory')
+    parser.add_argument('--batch-size', type=int, default=500,
+                        help='entities per datastore call')
+    args = parser.parse_args()
+
+    if not args.sdk:
+        parser.error('App Engine SDK not found, pass --sdk')
+    setup_sdk(args.sdk)
+    connect(args.host)
+
+    if args.action == 'export':
+        report = export_data(args.path, args.batch_size)
+    else:
+        report = import_data(args.path, args.batch_size)
+    print(json.dumps(report, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+'''
+precompile templates/*.html to python modules in compiled_templates/,
+run this before deploying, production instances load the compiled
+modules (see helpers/TemplateHelper.py) instead of parsing templates.
+the local jinja2 must be the version pinned in app.yaml: modules compiled
+by another version may not load at runtime (ModuleLoader then silently
+falls back to parsing the templates)
+
+usage: python tools/compile_templates.py
+'''
+import os
+import re
+import shutil
+import sys
+
+import jinja2
+
+root_dir = os.path.normpath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+template_dir = os.path.join(root_dir, 'templates')
+compiled_template_dir = os.path.join(root_dir, 'compiled_templates')
+
+JINJA2_LIBRARY_RE = re.compile(
+    r'-\s*name:\s*jinja2\s+version:\s*["\']?([^"\'\s]+)')
+
+
+def get_pinned_version():
+    '''
+    jinja2 version of the libraries section of app.yaml
+    '''
+    with open(os.path.join(root_dir, 'app.yaml')) as app_yaml:
+        match = JINJA2_LIBRARY_RE.search(app_yaml.read())
+    return match and match.group(1)
+
+
+def compile_templates():
+    # same options as the environment in helpers/TemplateHelper.py
+    env = jinja2.Environment(
+        loader=jinja2.FileSystemLoader(template_dir), autoescape=True)
+
+    # start from scratch, so deleted templates don't linger
+    if os.path.isdir(compiled_template_dir):
+        shutil.rmtree(compiled_template_dir)
+
+    env.compile_templates(
+        compiled_template_dir,
+        filter_func=lambda name: name.endswith('.html'),
+        zip=None,
+        ignore_errors=False)
+
+    compiled = os.listdir(compiled_template_dir)
+    print('compiled %d templates to %s' % (len(compiled),
+                                           compiled_template_dir))
+
+
+def main():
+    pinned = get_pinned_version()
+    if pinned != jinja2.__version__:
+        sys.exit('jinja2 %s is installed, app.yaml pins %s: install the '
+                 'pinned version (pip install jinja2==%s) to compile '
+                 'templates' % (jinja2.__version__, pinned, pinned))
+    compile_templates()
+
+
+if __name__ == '__main__':
+    main()
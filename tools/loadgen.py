@@ -0,0 +1,387 @@
+'''
+generate load with a mix of anonymous reads, logged in reads, likes,
+comments and edits, against blog.app in process (testbed stubs seeded
+like tools/bench_suite.py) or against a running server (--url).
+
+usage: python tools/loadgen.py [--url http://localhost:8080]
+           [--sdk PATH] [--dataset small] [--users 10] [--duration 30]
+           [--mix anon_read=50,user_read=30,like=10,comment=5,edit=5]
+           [--hot-posts 0] [--seed 1] [--output FILE]
+every virtual user signs up and logs in through /signup and /login and
+keeps the session cookie it is issued, then sends requests back to back.
+--hot-posts N sends likes and comments to N posts only, to find entity
+group contention. in process runs share one python process (and its
+GIL), use --url for throughput numbers.
+prints (and writes to --output) a json report per route: requests,
+throughput, latency percentiles in milliseconds, errors and contention
+errors (5xx responses caused by transaction conflicts, recognized in
+the error page, so run servers in development mode).
+'''
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import urllib
+import urllib2
+
+from bench_coldstart import find_sdk
+from bench_coldstart import setup_sdk
+from bench_suite import DATASETS
+from bench_suite import PASSWORD
+from bench_suite import percentile
+
+ACTIONS = ('anon_read', 'user_read', 'like', 'comment', 'edit')
+
+DEFAULT_MIX = 'anon_read=50,user_read=30,like=10,comment=5,edit=5'
+
+# front page pages scraped for post ids
+DISCOVER_PAGES = 5
+
+# error responses containing one of these are counted as contention
+CONTENTION_MARKERS = ('TransactionFailedError', 'too much contention',
+                      'Concurrency', 'concurrent transaction')
+
+POST_ID_RE = re.compile(r'/post/([0-9]+)')
+OLDER_PAGE_RE = re.compile(r'class="olderposts" href="([^"]+)"')
+
+
+class Response(object):
+
+    def __init__(self, status, location, body):
+        self.status = status
+        self.location = location or ''
+        self.body = body
+
+
+class Client(object):
+
+    '''
+    one browser: keeps the cookies it is sent, does not follow redirects
+    '''
+
+    def __init__(self):
+        self.cookies = {}
+
+    def get_cookie_header(self):
+        return '; '.join('%s=%s' % item for item in self.cookies.items())
+
+    def store_cookies(self, set_cookies):
+        for set_cookie in set_cookies:
+            name, _, value = set_cookie.split(';')[0].partition('=')
+            if value:
+                self.cookies[name.strip()] = value.strip()
+            else:
+                self.cookies.pop(name.strip(), None)
+
+
+class InProcessClient(Client):
+
+    def __init__(self, app):
+        Client.__init__(self)
+        self.app = app
+
+    def request(self, method, path, params=None):
+        import webapp2
+
+        if method == 'POST':
+            request = webapp2.Request.blank(path, POST=params)
+        else:
+            request = webapp2.Request.blank(path)
+        if self.cookies:
+            request.headers['Cookie'] = self.get_cookie_header()
+        try:
+            response = request.get_response(self.app)
+        except Exception as error:
+            # webapp2 in debug mode raises unhandled errors
+            return Response(500, None, '%s: %s' % (
+                type(error).__name__, error))
+        self.store_cookies(response.headers.getall('Set-Cookie'))
+        return Response(response.status_int,
+                        response.headers.get('Location'), response.body)
+
+
+class NoRedirectHandler(urllib2.HTTPRedirectHandler):
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpClient(Client):
+
+    def __init__(self, url):
+        Client.__init__(self)
+        self.url = url.rstrip('/')
+        self.opener = urllib2.build_opener(NoRedirectHandler())
+
+    def request(self, method, path, params=None):
+        data = urllib.urlencode(params) if method == 'POST' else None
+        request = urllib2.Request(self.url + path, data)
+        if self.cookies:
+            request.add_header('Cookie', self.get_cookie_header())
+        try:
+            response = self.opener.open(request)
+        except urllib2.HTTPError as error:
+            # redirects and error statuses
+            response = error
+        self.store_cookies(response.info().getheaders('Set-Cookie'))
+        return Response(response.getcode(),
+                        response.info().getheader('Location'),
+                        response.read())
+
+
+class Recorder(object):
+
+    '''
+    collects (route, seconds, status, contention) of every request
+    '''
+
+    def __init__(self):
+        self.records = []
+        self.lock = threading.Lock()
+
+    def request(self, client, route, method, path, params=None):
+        started = time.time()
+        response = client.request(method, path, params)
+        duration = time.time() - started
+        contention = response.status >= 500 and any(
+            marker in response.body for marker in CONTENTION_MARKERS)
+        with self.lock:
+            self.records.append(
+                (route, duration, response.status, contention))
+        return response
+
+    def get_report(self, duration):
+        routes = {}
+        for route, seconds, status, contention in self.records:
+            routes.setdefault(route, []).append((seconds, status, contention))
+
+        report = {}
+        for route, samples in sorted(routes.items()):
+            latencies = [s[0] * 1000 for s in samples]
+            statuses = {}
+            for s in samples:
+                statuses[str(s[1])] = statuses.get(str(s[1]), 0) + 1
+            report[route] = dict(
+                requests=len(samples),
+                throughput_rps=len(samples) / duration,
+                p50_ms=percentile(latencies, 50),
+                p95_ms=percentile(latencies, 95),
+                p99_ms=percentile(latencies, 99),
+                max_ms=max(latencies),
+                errors=sum(1 for s in samples if s[1] >= 500),
+                contention_errors=sum(1 for s in samples if s[2]),
+                statuses=statuses)
+        return report
+
+
+def parse_mix(mix):
+    '''
+    'anon_read=50,like=10' => [('anon_read', 50.0), ('like', 10.0)]
+    '''
+    weights = []
+    for part in mix.split(','):
+        action, _, weight = part.partition('=')
+        if action.strip() not in ACTIONS:
+            raise ValueError('unknown action %r' % action)
+        weights.append((action.strip(), float(weight)))
+    return weights
+
+
+def pick(rng, weights):
+    point = rng.uniform(0, sum(weight for action, weight in weights))
+    for action, weight in weights:
+        point -= weight
+        if point <= 0:
+            break
+    return action
+
+
+def discover_post_ids(client):
+    '''
+    post ids linked from the first pages of the front page
+    '''
+    post_ids = []
+    path = '/'
+    for _ in range(DISCOVER_PAGES):
+        body = client.request('GET', path).body
+        for post_id in POST_ID_RE.findall(body):
+            if post_id not in post_ids:
+                post_ids.append(post_id)
+        older = OLDER_PAGE_RE.search(body)
+        if not older:
+            break
+        path = older.group(1).replace('&amp;', '&')
+    return post_ids
+
+
+class VirtualUser(object):
+
+    '''
+    a logged in user with a post of its own, plus an anonymous browser
+    '''
+
+    def __init__(self, make_client, recorder, username, rng):
+        self.client = make_client()
+        self.anonymous = make_client()
+        self.recorder = recorder
+        self.username = username
+        self.rng = rng
+        self.post_id = None
+
+    def request(self, route, method, path, params=None, client=None):
+        return self.recorder.request(client or self.client, route,
+                                     method, path, params)
+
+    def setup(self):
+        '''
+        sign up, log in and write a post to edit later
+        '''
+        self.request('POST /signup', 'POST', '/signup',
+                     dict(username=self.username, password=PASSWORD,
+                          verify=PASSWORD))
+        self.client.cookies.clear()
+        self.request('POST /login', 'POST', '/login',
+                     dict(username=self.username, password=PASSWORD))
+        response = self.request('POST /newpost', 'POST', '/newpost',
+                                dict(subject='load test post',
+                                     content='load test\ncontent'))
+        match = POST_ID_RE.search(response.location)
+        self.post_id = match and match.group(1)
+
+    def read(self, post_ids):
+        choice = self.rng.random()
+        if choice < 0.4:
+            return ('GET /', '/')
+        if choice < 0.8:
+            return ('GET /post/id', '/post/%s' % self.rng.choice(post_ids))
+        if choice < 0.9:
+            return ('GET /post/id?comments=all',
+                    '/post/%s?comments=all' % self.rng.choice(post_ids))
+        return ('GET /archive', '/archive')
+
+    def run(self, action, post_ids, hot_post_ids):
+        if action in ('anon_read', 'user_read'):
+            client = self.anonymous if action == 'anon_read' else None
+            route, path = self.read(post_ids)
+            if action == 'anon_read':
+                route += ' (anonymous)'
+            self.request(route, 'GET', path, client=client)
+        elif action == 'like':
+            post_id = self.rng.choice(hot_post_ids)
+            if self.rng.random() < 0.5:
+                self.request('GET /likepost/id', 'GET',
+                             '/likepost/%s' % post_id)
+            else:
+                self.request('GET /unlikepost/id', 'GET',
+                             '/unlikepost/%s' % post_id)
+        elif action == 'comment':
+            self.request('POST /newcomment/id', 'POST',
+                         '/newcomment/%s' % self.rng.choice(hot_post_ids),
+                         dict(comment='load test comment'))
+        elif action == 'edit' and self.post_id:
+            self.request('POST /editpost/id', 'POST',
+                         '/editpost/%s' % self.post_id,
+                         dict(subject='load test post (edited)',
+                              content='load test\nedited content'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--url', help='server to load, else in process')
+    parser.add_argument('--sdk', default=find_sdk(),
+                        help='App Engine SDK directory (in process)')
+    parser.add_argument('--dataset', choices=sorted(DATASETS),
+                        default='small', help='seeded data (in process)')
+    parser.add_argument('--users', type=int, default=10,
+                        help='concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=30,
+                        help='seconds of load')
+    parser.add_argument('--mix', default=DEFAULT_MIX,
+                        help='action weights')
+    parser.add_argument('--hot-posts', type=int, default=0,
+                        help='likes and comments go to this many posts')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='random seed of the dataset and requests')
+    parser.add_argument('--output', help='write the report to this file')
+    args = parser.parse_args()
+
+    try:
+        weights = parse_mix(args.mix)
+    except ValueError as error:
+        parser.error(str(error))
+
+    rng = random.Random(args.seed)
+    if args.url:
+        def make_client():
+            return HttpClient(args.url)
+    else:
+        if not args.sdk:
+            parser.error('App Engine SDK not found, pass --sdk or --url')
+        setup_sdk(args.sdk)
+        import bench_suite
+        bench_suite.setup_testbed()
+        import blog
+        bench_suite.seed(DATASETS[args.dataset], rng)
+
+        def make_client():
+            return InProcessClient(blog.app)
+
+    recorder = Recorder()
+    run_id = '%06x' % rng.getrandbits(24)
+    users = [VirtualUser(make_client, recorder, 'load%s%04d' % (run_id, i),
+                         random.Random(rng.random()))
+             for i in range(args.users)]
+    started = time.time()
+    for user in users:
+        user.setup()
+    setup = recorder.get_report(time.time() - started)
+
+    post_ids = discover_post_ids(make_client())
+    post_ids.extend(user.post_id for user in users if user.post_id)
+    if not post_ids:
+        parser.error('no posts found')
+    hot_post_ids = post_ids[:args.hot_posts] if args.hot_posts else post_ids
+
+    # setup requests are reported apart from the load
+    recorder.records = []
+    stop_at = time.time() + args.duration
+
+    def work(user):
+        while time.time() < stop_at:
+            user.run(pick(user.rng, weights), post_ids, hot_post_ids)
+
+    started = time.time()
+    threads = [threading.Thread(target=work, args=(user,))
+               for user in users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.time() - started
+
+    routes = recorder.get_report(duration)
+    report = dict(
+        target=args.url or 'in process (%s dataset)' % args.dataset,
+        users=args.users,
+        mix=dict(weights),
+        hot_posts=args.hot_posts,
+        duration_s=duration,
+        requests=len(recorder.records),
+        throughput_rps=len(recorder.records) / duration,
+        errors=sum(route['errors'] for route in routes.values()),
+        contention_errors=sum(route['contention_errors']
+                              for route in routes.values()),
+        routes=routes,
+        setup=setup)
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()